@@ -0,0 +1,382 @@
+import argparse
+import getpass
+import json
+import multiprocessing
+import os
+import psycopg2
+import random
+import resource
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import timeit
+import traceback
+from datetime import datetime, timedelta
+
+# the loader lives one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import load_networks  # noqa: E402
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "load_networks.sql")
+
+SOURCES = [
+    '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+    '<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+    '<a href="http://twitter.com/download/android" rel="nofollow">Twitter for Android</a>',
+]
+
+# each phase loads files that only have one kind of data in them so that every table gets its own numbers
+PHASES = {
+    "user_friend": {"friends": True},
+    "user_follower": {"followers": True},
+    "tweet": {"tweets": True},
+    "embedded_user": {"tweets": True, "embedded_users": True},
+}
+
+# the table every generated row of a phase should end up in, and the flag that says how many rows each file has.
+# embedded users are deduplicated so the embedded_user phase is checked by its tweets instead.
+EXPECTED = {
+    "user_friend": ("user_friend", "friends"),
+    "user_follower": ("user_follower", "followers"),
+    "tweet": ("tweet", "tweets"),
+    "embedded_user": ("tweet", "tweets"),
+}
+
+
+def random_text(rng, words):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(words))
+
+
+def random_id(rng):
+    # ids are stored as bigint so they have to fit in a signed 64 bit integer
+    return str(rng.randint(10 ** 17, 2 ** 63 - 1))
+
+
+def twitter_time(value):
+    return value.strftime("%a %b %d %H:%M:%S +0000 %Y")  # Sat Dec 31 04:34:35 +0000 2011
+
+
+class Generator:
+    # builds files that look like the ones get_networks.py writes
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.now = datetime(2023, 1, 1)
+
+        # a fixed pool of users gets retweeted and quoted so that embedded users repeat like they do in real data
+        self.users = [self.user() for _ in range(args.users)]
+
+    def user(self):
+        rng = self.rng
+        id = random_id(rng)
+        return {
+            "id": int(id),
+            "id_str": id,
+            "name": random_text(rng, 2),
+            "screen_name": "".join(rng.choices(string.ascii_lowercase, k=12)),
+            "location": random_text(rng, 2),
+            "description": random_text(rng, 20),
+            "url": None,
+            "protected": False,
+            "followers_count": rng.randint(0, 100000),
+            "friends_count": rng.randint(0, 5000),
+            "listed_count": rng.randint(0, 100),
+            "created_at": twitter_time(self.now - timedelta(days=rng.randint(0, 4000))),
+            "favourites_count": rng.randint(0, 50000),
+            "verified": rng.random() < 0.05,
+            "statuses_count": rng.randint(0, 100000),
+            "lang": None,
+            "profile_image_url_https": "https://pbs.twimg.com/profile_images/{}/photo.jpg".format(random_id(rng)),
+        }
+
+    def entities(self):
+        rng = self.rng
+        return {
+            "hashtags": [{"text": random_text(rng, 1), "indices": [0, 0]} for _ in range(rng.randint(0, round(2 * self.args.hashtags)))],
+            "urls": [{
+                "url": "https://t.co/{}".format(random_text(rng, 1)),
+                "expanded_url": "https://example.com/{}".format(random_text(rng, 1)),
+                "display_url": "example.com",
+                "indices": [0, 0],
+            } for _ in range(rng.randint(0, round(2 * self.args.urls)))],
+            "user_mentions": [],
+            "symbols": [],
+        }
+
+    def tweet(self, user, nested=True):
+        rng = self.rng
+        tweet = {
+            "created_at": twitter_time(self.now - timedelta(seconds=rng.randint(0, 10 ** 7))),
+            "id_str": random_id(rng),
+            "full_text": random_text(rng, rng.randint(5, 40)),
+            "truncated": False,
+            "display_text_range": [0, 140],
+            "entities": self.entities(),
+            "source": rng.choice(SOURCES),
+            "in_reply_to_status_id_str": None,
+            "in_reply_to_user_id_str": None,
+            "in_reply_to_screen_name": None,
+            "user": user,
+            "is_quote_status": False,
+            "retweet_count": rng.randint(0, 1000),
+            "favorite_count": rng.randint(0, 5000),
+            "favorited": False,
+            "retweeted": False,
+            "lang": "en",
+        }
+        tweet["id"] = int(tweet["id_str"])
+
+        if nested:
+            roll = rng.random()
+            if roll < self.args.retweet_ratio:
+                original = self.tweet(rng.choice(self.users), nested=False)
+                tweet["retweeted_status"] = original
+                tweet["full_text"] = "RT @{}: {}".format(original["user"]["screen_name"], original["full_text"])
+            elif roll < self.args.retweet_ratio + self.args.quote_ratio:
+                tweet["quoted_status"] = self.tweet(rng.choice(self.users), nested=False)
+                tweet["is_quote_status"] = True
+
+        return tweet
+
+    def account(self, friends=False, followers=False, tweets=False):
+        rng = self.rng
+        user = self.user()
+        return {
+            "id": user["id_str"],
+            "screen_name": user["screen_name"],
+            "captured_at": str(self.now),
+            "created_at": str(datetime.strptime(user["created_at"], "%a %b %d %H:%M:%S +0000 %Y")),
+            "favorites_count": user["favourites_count"],
+            "tweet_count": user["statuses_count"],
+            "friend_ids": [random_id(rng) for _ in range(self.args.friends)] if friends else None,
+            "follower_ids": [random_id(rng) for _ in range(self.args.followers)] if followers else None,
+            "tweets": [self.tweet(user) for _ in range(self.args.tweets)] if tweets else None,
+            "user": user,
+        }
+
+    def write(self, path, count, **kwargs):
+        os.makedirs(path, exist_ok=True)
+        for i in range(count):
+            with open(os.path.join(path, "{}.json".format(i)), "wt") as f:
+                print(json.dumps(self.account(**kwargs), indent=4), file=f)
+
+
+def create_schema(args, prefix):
+    with open(SCHEMA_FILE, "rt") as f:
+        schema = f.read().replace("network_", "{}_".format(prefix))
+
+    conn = psycopg2.connect(host=args.host, dbname=args.database, user=args.username)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(schema)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_schema(args, prefix):
+    conn = psycopg2.connect(host=args.host, dbname=args.database, user=args.username)
+    try:
+        with conn.cursor() as cur:
+            for table in ["tweet", "user_friend", "user_follower", "user"]:
+                cur.execute("DROP TABLE IF EXISTS public.{}_{}".format(prefix, table))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def count_rows(args, prefix, table):
+    conn = psycopg2.connect(host=args.host, dbname=args.database, user=args.username)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM public.{}_{}".format(prefix, table))
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_phase(args, prefix, input_files, embedded_users, results):
+    # runs in its own freshly spawned process so that the peak memory belongs to this phase alone. a forked
+    # process would start out with the parent's peak, generator and all.
+    try:
+        profiler = load_networks.StageProfiler()
+        load_networks.load_batches(args.host, args.database, args.username, prefix, input_files,
+                                   batch_files=args.batch_files, embedded_users=embedded_users, profiler=profiler)
+        results.put({
+            "report": profiler.report(),
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+    except Exception:
+        results.put({"error": traceback.format_exc()})
+
+
+def bench_database(args, generator, workdir):
+    prefix = "bench_{}".format("".join(random.choices(string.ascii_lowercase, k=8)))
+    print("creating tables with prefix {}".format(prefix), file=sys.stderr)
+    create_schema(args, prefix)
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    try:
+        for phase, options in PHASES.items():
+            path = os.path.join(workdir, phase)
+            generator.write(path, args.files, **{k: v for k, v in options.items() if k != "embedded_users"})
+            input_files = sorted(os.path.join(path, x) for x in os.listdir(path))
+
+            table, size = EXPECTED[phase]
+            before = count_rows(args, prefix, table)
+
+            queue = context.Queue()
+            p = context.Process(target=run_phase, args=(args, prefix, input_files, options.get("embedded_users", False), queue))
+            p.start()
+            result = queue.get()
+            p.join()
+            if "error" in result:
+                raise RuntimeError("could not load {}:\n{}".format(phase, result["error"]))
+
+            # a file that fails to load is skipped, which would otherwise look like a very fast load
+            loaded = count_rows(args, prefix, table) - before
+            expected = args.files * getattr(args, size)
+            if loaded != expected:
+                raise RuntimeError("{} loaded {} rows into {} but {} were generated".format(phase, loaded, table, expected))
+
+            report = result["report"]
+            rows = report["counts"].get(phase, 0)
+            seconds = report["elapsed"]
+            if phase == "embedded_user":
+                # this phase loads the same number of tweets as the tweet phase did, so only the time on top of
+                # that went into the embedded users
+                seconds = seconds - results["tweet"]["total_seconds"]
+            results[phase] = {
+                "rows": rows,
+                "seconds": seconds,
+                "total_seconds": report["elapsed"],
+                "rows_per_second": rows / seconds if seconds > 0 else None,
+                "peak_rss_kb": result["peak_rss_kb"],
+                "stages": report["seconds"],
+            }
+            print("{:<16} {:>10} rows {:>10.0f} rows/s {:>10} KB peak".format(phase, rows, results[phase]["rows_per_second"] or 0, result["peak_rss_kb"]), file=sys.stderr)
+    finally:
+        if not args.keep:
+            drop_schema(args, prefix)
+
+    return results
+
+
+def bench_functions(args, generator):
+    tweets = [generator.tweet(generator.rng.choice(generator.users)) for _ in range(args.tweets)]
+    rows = [load_networks.process_tweet(x) for x in tweets]
+    friends = [[str(datetime.now()), random_id(generator.rng), random_id(generator.rng)] for _ in range(args.tweets)]
+
+    cases = {
+        "get_complete_text": lambda: [load_networks.get_complete_text(x) for x in tweets],
+        "get_source": lambda: [load_networks.get_source(x["source"]) for x in tweets],
+        "process_tweet": lambda: [load_networks.process_tweet(x) for x in tweets],
+        "clean_line": lambda: [load_networks.clean_line(x) for x in friends],
+        "clean_nullable_line": lambda: [load_networks.clean_nullable_line(x) for x in rows],
+    }
+
+    results = {}
+    for name, fn in cases.items():
+        # best of several runs is the least noisy number to compare between runs
+        seconds = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        results[name] = {
+            "rows": len(tweets),
+            "seconds": seconds,
+            "rows_per_second": len(tweets) / seconds if seconds else None,
+        }
+        print("{:<20} {:>12.0f} rows/s".format(name, results[name]["rows_per_second"] or 0), file=sys.stderr)
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(SCHEMA_FILE), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(args, parameters, results):
+    # find the last run with the same parameters and show how much faster or slower this one was
+    previous = None
+    if os.path.exists(args.results):
+        with open(args.results, "rt") as f:
+            for line in f:
+                run = json.loads(line)
+                if run["parameters"] == parameters:
+                    previous = run
+
+    if previous is None:
+        return
+
+    print(file=sys.stderr)
+    print("compared to {} at {}".format(previous["commit"], previous["started_at"]), file=sys.stderr)
+    for group in ["functions", "database"]:
+        for name, result in results.get(group, {}).items():
+            before = previous["results"].get(group, {}).get(name, {}).get("rows_per_second")
+            if before and result["rows_per_second"]:
+                print("{:<20} {:>+8.1f}%".format(name, 100 * (result["rows_per_second"] - before) / before), file=sys.stderr)
+
+
+def main():
+    username = getpass.getuser()
+
+    parser = argparse.ArgumentParser(
+        prog="bench_load_networks",
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument("--host", help="the database cluster to load the data into", default="localhost")
+    parser.add_argument("-d", "--database", help="the database to load the data into", default=username)
+    parser.add_argument("-u", "--username", help="the name of the user to use when connecting to the database", default=username)
+    parser.add_argument("--no-database", dest="no_database", action="store_true", help="only time the functions that do not need a database")
+    parser.add_argument("--keep", action="store_true", help="leave the benchmark tables behind instead of dropping them")
+    parser.add_argument("--results", help="a file that every run is appended to", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl"))
+    parser.add_argument("--seed", type=int, help="the seed for generating data so that runs are comparable", default=1)
+    parser.add_argument("--files", type=int, help="how many account files to load for each table", default=20)
+    parser.add_argument("--tweets", type=int, help="how many tweets each account has", default=2000)
+    parser.add_argument("--friends", type=int, help="how many friends each account has", default=5000)
+    parser.add_argument("--followers", type=int, help="how many followers each account has", default=50000)
+    parser.add_argument("--users", type=int, help="how many different users get retweeted and quoted", default=5000)
+    parser.add_argument("--retweet-ratio", dest="retweet_ratio", type=float, help="the fraction of tweets that are retweets", default=0.4)
+    parser.add_argument("--quote-ratio", dest="quote_ratio", type=float, help="the fraction of tweets that are quotes", default=0.1)
+    parser.add_argument("--hashtags", type=float, help="the average number of hashtags on a tweet", default=1)
+    parser.add_argument("--urls", type=float, help="the average number of urls on a tweet", default=0.5)
+    parser.add_argument("--batch-files", dest="batch_files", type=int, help="commit after loading this many files", default=1)
+    parser.add_argument("--repeat", type=int, help="how many times to run each function benchmark", default=5)
+    args = parser.parse_args()
+
+    parameters = {k: v for k, v in vars(args).items() if k not in ["host", "database", "username", "keep", "results"]}
+    started_at = str(datetime.now())
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_networks_")
+    try:
+        generator = Generator(args)
+
+        results = {"functions": bench_functions(args, generator)}
+        if not args.no_database:
+            results["database"] = bench_database(args, generator, workdir)
+
+        compare(args, parameters, results)
+        with open(args.results, "at") as f:
+            print(json.dumps({
+                "started_at": started_at,
+                "commit": git_commit(),
+                "parameters": parameters,
+                "results": results,
+            }), file=f)
+
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
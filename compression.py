@@ -0,0 +1,182 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import sys
+import traceback
+from glob import glob
+
+# zstandard is only needed when something is actually written or read with zstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+EXTENSIONS = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+DEFAULT_LEVELS = {
+    "gzip": 9,  # the same as gzip.open
+    "zstd": 3,
+}
+
+# writers use whatever dictionary is here. a copy named after its id is kept too so that files written with an
+# older dictionary can still be read after a new one is trained.
+DICTIONARY_FILE = "zstd.dict"
+DICTIONARY_ID_FILE = "zstd-{}.dict"
+
+
+def add_arguments(parser, default="gzip"):
+    parser.add_argument("--compression", choices=sorted(EXTENSIONS), default=default, help="how to compress the output files")
+    parser.add_argument("--compression-level", dest="compression_level", type=int, help="how hard to compress, where higher is smaller and slower")
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstd compression needs the zstandard library. install it with: pip3 install zstandard")
+
+
+def extension(codec: str) -> str:
+    return EXTENSIONS[codec]
+
+
+def strip_extension(path: str) -> str:
+    for ext in EXTENSIONS.values():
+        if ext and path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def load_dictionary(directory: str, dict_id: int = None):
+    path = os.path.join(directory, DICTIONARY_FILE if dict_id is None else DICTIONARY_ID_FILE.format(dict_id))
+    if not os.path.exists(path):
+        return None
+
+    require_zstandard()
+    with open(path, "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+class Writer:
+    # opens text files for writing with one codec. holding on to one of these saves loading the dictionary for every file.
+    def __init__(self, codec: str, level: int = None, directory: str = None):
+        self.codec = codec
+        self.level = level if level is not None else DEFAULT_LEVELS.get(codec)
+        self.dictionary = None
+
+        if codec == "zstd":
+            require_zstandard()
+            if directory is not None:
+                self.dictionary = load_dictionary(directory)
+
+    def extension(self) -> str:
+        return extension(self.codec)
+
+    def open(self, path: str):
+        if self.codec == "gzip":
+            return gzip.open(path, "wt", compresslevel=self.level)
+
+        if self.codec == "zstd":
+            cctx = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+            return zstandard.open(path, "wt", cctx=cctx, encoding="utf-8")
+
+        return open(path, "wt")
+
+
+def open_input(path: str):
+    if path.endswith(EXTENSIONS["gzip"]):
+        return gzip.open(path, "rt")
+
+    if path.endswith(EXTENSIONS["zstd"]):
+        require_zstandard()
+
+        # the frame says which dictionary it was written with, if any
+        with open(path, "rb") as f:
+            params = zstandard.get_frame_parameters(f.read(18))
+        dictionary = None
+        if params.dict_id:
+            dictionary = load_dictionary(os.path.dirname(path), params.dict_id)
+            if dictionary is None:
+                raise RuntimeError("{} needs zstd dictionary {} which is not next to it".format(path, params.dict_id))
+
+        dctx = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return zstandard.open(path, "rt", dctx=dctx, encoding="utf-8")
+
+    return open(path, "rt")
+
+
+def samples_from(path: str, size: int = 4096):
+    with open_input(path) as f:
+        text = f.read()
+
+    # files with one tweet per line are sampled by tweet, anything else is cut into pieces
+    lines = text.splitlines()
+    if lines and lines[0].startswith("{") and lines[0].endswith("}"):
+        return [x.encode("utf-8") for x in lines if x]
+    return [text[i:i + size].encode("utf-8") for i in range(0, len(text), size)]
+
+
+def train(directory: str, pattern: str, dict_size: int, max_samples: int, seed: int):
+    logger = logging.getLogger()
+    require_zstandard()
+
+    input_files = [x for x in glob(os.path.join(directory, pattern)) if strip_extension(x).endswith(".json")]
+    random.Random(seed).shuffle(input_files)
+
+    samples = []
+    for input_file in input_files:
+        samples += samples_from(input_file)
+        if len(samples) >= max_samples:
+            break
+    samples = samples[:max_samples]
+    logger.info("training a {} byte dictionary from {} samples".format(dict_size, len(samples)))
+
+    dictionary = zstandard.train_dictionary(dict_size, samples)
+    data = dictionary.as_bytes()
+    for name in [DICTIONARY_ID_FILE.format(dictionary.dict_id()), DICTIONARY_FILE]:
+        with open(os.path.join(directory, "{}.tmp".format(name)), "wb") as f:
+            f.write(data)
+        os.rename(os.path.join(directory, "{}.tmp".format(name)), os.path.join(directory, name))
+
+    logger.info("wrote dictionary {} to {}".format(dictionary.dict_id(), directory))
+    return dictionary.dict_id()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="compression",
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument("directory", help="a directory of output files to train a zstd dictionary from, and to keep it in")
+    parser.add_argument("--pattern", help="which files in the directory to sample", default="*")
+    parser.add_argument("--dict-size", dest="dict_size", type=int, help="how big the dictionary should be in bytes", default=112640)
+    parser.add_argument("--samples", type=int, help="the most samples to train from", default=100000)
+    parser.add_argument("--seed", type=int, help="the seed for picking which files to sample", default=1)
+    args = parser.parse_args()
+
+    # configure logging
+    logging.captureWarnings(True)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    log_handler = logging.StreamHandler(stream=sys.stderr)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s - %(message)s"))
+    logger.addHandler(log_handler)
+
+    try:
+        dict_id = train(args.directory, args.pattern, args.dict_size, args.samples, args.seed)
+        print(json.dumps({"dict_id": dict_id, "directory": args.directory}))
+        return 0
+    except Exception:
+        logger.error(traceback.format_exc())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import heapq
+import logging
+import math
+import sys
+import tweepy
+from datetime import datetime, timedelta
+from tweepy import TweepError
+
+
+# requests allowed per credential in each fifteen minute window
+WINDOW = 15 * 60
+RATE_LIMITS = {
+    "users/show": 900,
+    "statuses/user_timeline": 900,
+    "followers/ids": 15,
+    "friends/ids": 15,
+}
+
+# the most results one request returns
+PAGE_SIZES = {
+    "statuses/user_timeline": 200,
+    "followers/ids": 5000,
+    "friends/ids": 5000,
+}
+
+# user_timeline only ever goes back this far
+TIMELINE_LIMIT = 3200
+
+LOOKUP_SIZE = 100
+
+
+def add_arguments(parser):
+    parser.add_argument("--plan", action="store_true", help="look up every account first, estimate how long each will take and start with the longest")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="print the plan to stdout and stop without fetching anything")
+
+
+def lookup_users(apis, accounts):
+    logger = logging.getLogger()
+
+    # users/lookup takes a hundred accounts at a time so this is cheap compared to the crawl itself
+    users = {}
+    batches = [accounts[i:i + LOOKUP_SIZE] for i in range(0, len(accounts), LOOKUP_SIZE)]
+    for i, batch in enumerate(batches):
+        api = apis[i % len(apis)]
+        ids = [x for x in batch if x.isdigit()]
+        names = [x for x in batch if not x.isdigit()]
+        try:
+            for user in api.lookup_users(user_ids=ids or None, screen_names=names or None):
+                data = user._json
+                users[data["id_str"]] = data
+                users[data["screen_name"].lower()] = data
+        except TweepError as e:
+            # a batch where nothing exists anymore comes back as an error
+            logger.warning("could not look up {} accounts: {}".format(len(batch), e))
+
+    return [users.get(x, users.get(x.lower())) for x in accounts]
+
+
+def account_calls(user, fetch_tweets, fetch_friends, fetch_followers):
+    calls = {"users/show": 1}
+
+    # accounts that are missing, suspended or protected stop after the first request
+    if user is None or user.get("protected"):
+        return calls
+
+    if fetch_tweets:
+        calls["statuses/user_timeline"] = max(math.ceil(min(user["statuses_count"], TIMELINE_LIMIT) / PAGE_SIZES["statuses/user_timeline"]), 1)
+    if fetch_followers:
+        calls["followers/ids"] = max(math.ceil(user["followers_count"] / PAGE_SIZES["followers/ids"]), 1)
+    if fetch_friends:
+        calls["friends/ids"] = max(math.ceil(user["friends_count"] / PAGE_SIZES["friends/ids"]), 1)
+    return calls
+
+
+def calls_seconds(calls):
+    # one credential works through an account one endpoint after another, each at its own rate limit
+    return sum(WINDOW * count / RATE_LIMITS[endpoint] for endpoint, count in calls.items())
+
+
+def schedule(seconds, workers):
+    # longest job first onto whichever credential is free soonest. this is what the shared queue does
+    # on its own once the accounts are sorted longest first.
+    order = sorted(range(len(seconds)), key=lambda x: -seconds[x])
+    loads = [(0.0, worker) for worker in range(workers)]
+    heapq.heapify(loads)
+
+    assignments = [None] * len(seconds)
+    totals = [0.0] * workers
+    for i in order:
+        load, worker = heapq.heappop(loads)
+        assignments[i] = worker
+        totals[worker] = load + seconds[i]
+        heapq.heappush(loads, (totals[worker], worker))
+
+    return order, assignments, totals
+
+
+def plan(apis, accounts, fetch_tweets, fetch_friends, fetch_followers):
+    logger = logging.getLogger()
+
+    users = lookup_users(apis, accounts)
+    calls = [account_calls(x, fetch_tweets, fetch_friends, fetch_followers) for x in users]
+    seconds = [calls_seconds(x) for x in calls]
+    order, assignments, totals = schedule(seconds, len(apis))
+
+    makespan = max(totals) if totals else 0
+    endpoints = {}
+    for x in calls:
+        for endpoint, count in x.items():
+            endpoints[endpoint] = endpoints.get(endpoint, 0) + count
+
+    for endpoint, count in sorted(endpoints.items()):
+        logger.info("{} requests to {}, about {} on one credential".format(count, endpoint, timedelta(seconds=round(WINDOW * count / RATE_LIMITS[endpoint]))))
+    for worker, total in enumerate(totals):
+        logger.info("credential {} has {} accounts and about {} of work".format(worker, assignments.count(worker), timedelta(seconds=round(total))))
+    logger.info("{} accounts across {} credentials should finish in about {}, around {}".format(
+        len(accounts), len(apis), timedelta(seconds=round(makespan)), (datetime.now() + timedelta(seconds=makespan)).strftime("%Y-%m-%d %H:%M"),
+    ))
+
+    return [{
+        "account": accounts[i],
+        "user": users[i],
+        "calls": calls[i],
+        "seconds": seconds[i],
+        "credential": assignments[i],
+    } for i in order]
+
+
+def print_plan(planned, file=sys.stdout):
+    print("account,screen_name,followers,friends,statuses,requests,hours,credential", file=file)
+    for x in planned:
+        user = x["user"] or {}
+        print(",".join([
+            x["account"],
+            user.get("screen_name", ""),
+            str(user.get("followers_count", "")),
+            str(user.get("friends_count", "")),
+            str(user.get("statuses_count", "")),
+            str(sum(x["calls"].values())),
+            "{:.2f}".format(x["seconds"] / 3600),
+            str(x["credential"]),
+        ]), file=file)
+
+
+def get_apis(credentials):
+    apis = []
+    for c in credentials:
+        auth = tweepy.OAuthHandler(c["consumer_key"], c["consumer_secret"])
+        auth.set_access_token(c["access_token"], c["access_token_secret"])
+        apis.append(tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True))
+    return apis
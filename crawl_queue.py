@@ -0,0 +1,259 @@
+import argparse
+import getpass
+import json
+import logging
+import os
+import psycopg2
+import psycopg2.extras
+import socket
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from threading import Event, Thread
+
+
+def add_arguments(parser):
+    username = getpass.getuser()
+
+    parser.add_argument("--queue-job", dest="queue_job", help="the name of a shared job to claim work from instead of working through the input file alone")
+    parser.add_argument("--queue-host", dest="queue_host", help="the database cluster holding the work queue", default="venus.lab.cip.uw.edu")
+    parser.add_argument("--queue-database", dest="queue_database", help="the database holding the work queue", default=username)
+    parser.add_argument("--queue-username", dest="queue_username", help="the name of the user to use when connecting to the work queue", default=username)
+    parser.add_argument("--queue-lease", dest="queue_lease", type=int, help="how many seconds a claimed item is held before another worker may reclaim it", default=600)
+    parser.add_argument("--queue-attempts", dest="queue_attempts", type=int, help="how many times an item is tried before it is marked as failed", default=5)
+    parser.add_argument("--queue-linger", dest="queue_linger", type=int, help="how many seconds to wait between checks for expired leases once the queue has nothing left to claim", default=60)
+
+
+def connect(args):
+    return psycopg2.connect(host=args.queue_host, dbname=args.queue_database, user=args.queue_username)
+
+
+def worker_name(consumer_key):
+    # identifies a single thread on a single host so that leases can be traced back to their owner
+    return "{}:{}:{}".format(socket.gethostname(), os.getpid(), consumer_key)
+
+
+def enqueue(conn, job, items):
+    # items are (item, payload) tuples. every worker enqueues the same input so this must be idempotent.
+    with conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO public.crawl_queue (job, item, payload)
+            VALUES %s
+            ON CONFLICT (job, item) DO NOTHING
+        """, [(job, item, json.dumps(payload)) for item, payload in items], page_size=1000)
+    conn.commit()
+
+
+def claim(conn, job, worker, lease, attempts, limit=1):
+    # pending items and items whose lease has expired are both up for grabs
+    with conn.cursor() as cur:
+        # an expired lease that has used up its attempts will never be claimed again so give up on it
+        cur.execute("""
+            UPDATE public.crawl_queue SET
+                status = 'failed',
+                leased_until = NULL,
+                error = coalesce(error, 'lease expired')
+            WHERE job = %(job)s AND status = 'leased' AND leased_until < now() AND attempts >= %(attempts)s
+        """, {"job": job, "attempts": attempts})
+        cur.execute("""
+            UPDATE public.crawl_queue SET
+                status = 'leased',
+                leased_by = %(worker)s,
+                leased_until = now() + %(lease)s * interval '1 second',
+                attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM public.crawl_queue
+                WHERE job = %(job)s
+                  AND attempts < %(attempts)s
+                  AND (status = 'pending' OR (status = 'leased' AND leased_until < now()))
+                ORDER BY id
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, item, payload
+        """, {"job": job, "worker": worker, "lease": lease, "attempts": attempts, "limit": limit})
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+
+def renew(conn, ids, worker, lease):
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE public.crawl_queue SET
+                leased_until = now() + %(lease)s * interval '1 second'
+            WHERE id = ANY(%(ids)s) AND leased_by = %(worker)s AND status = 'leased'
+        """, {"ids": list(ids), "worker": worker, "lease": lease})
+        renewed = cur.rowcount
+    conn.commit()
+    return renewed
+
+
+def complete(conn, id, worker, result):
+    # only the worker that still holds the lease may finish the item. returns 0 if it was lost to another worker.
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE public.crawl_queue SET
+                status = 'done',
+                leased_by = %(worker)s,
+                leased_until = NULL,
+                finished_at = now(),
+                result = %(result)s,
+                error = NULL
+            WHERE id = %(id)s AND leased_by = %(worker)s AND status = 'leased'
+        """, {"id": id, "worker": worker, "result": json.dumps(result)})
+        completed = cur.rowcount
+    conn.commit()
+    return completed
+
+
+def fail(conn, id, worker, error, attempts):
+    # put the item back for someone else unless it has run out of attempts
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE public.crawl_queue SET
+                status = CASE WHEN attempts >= %(attempts)s THEN 'failed' ELSE 'pending' END,
+                leased_until = NULL,
+                error = %(error)s
+            WHERE id = %(id)s AND leased_by = %(worker)s AND status = 'leased'
+        """, {"id": id, "worker": worker, "error": error, "attempts": attempts})
+    conn.commit()
+
+
+def outstanding(conn, job):
+    # items that are still held by somebody and might come back if their lease expires
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT count(*) FROM public.crawl_queue
+            WHERE job = %(job)s AND status IN ('pending', 'leased')
+        """, {"job": job})
+        return cur.fetchone()[0]
+
+
+def keep_leases(args, ids, worker, stop, lost, conn=None):
+    logger = logging.getLogger()
+
+    # a connection that was passed in belongs to the caller and outlives this lease
+    owned = conn is None
+    if owned:
+        conn = connect(args)
+    try:
+        # renew well before the lease runs out so that a slow renewal does not lose it
+        while not stop.wait(max(args.queue_lease // 3, 1)):
+            if renew(conn, ids, worker, args.queue_lease) < len(ids):
+                logger.warning("lost the lease on some of {} for {}".format(ids, worker))
+                lost.set()
+    except Exception:
+        logger.error(traceback.format_exc())
+        if not owned:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+    finally:
+        if owned:
+            conn.close()
+
+
+@contextmanager
+def holding(args, ids, worker, conn=None):
+    # keep the lease alive for as long as the work inside takes, however long that is. the event that is yielded
+    # gets set if the lease could not be renewed, which means another worker may be doing the same work. pass a
+    # connection to renew over it instead of opening a new one for every lease.
+    stop = Event()
+    lost = Event()
+    t = Thread(args=(args, ids, worker, stop, lost, conn), target=keep_leases, daemon=True)
+    t.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        t.join()
+
+
+def work(args, worker, fn):
+    # claims items one at a time until the job is finished. fn is called with each item and its payload and
+    # returns the path of the file it wrote, which is recorded as the item's result.
+    logger = logging.getLogger()
+
+    # leases are renewed from another thread so they get their own connection, kept for every item this worker claims
+    conn = connect(args)
+    renew_conn = connect(args)
+    try:
+        while True:
+            claimed = claim(conn, args.queue_job, worker, args.queue_lease, args.queue_attempts)
+            if not claimed:
+                # other workers may still be holding leases that will expire if they die
+                if args.queue_linger > 0 and outstanding(conn, args.queue_job) > 0:
+                    time.sleep(args.queue_linger)
+                    continue
+                break
+
+            for id, item, payload in claimed:
+                try:
+                    logger.info("processing {} with {}".format(item, worker))
+                    if renew_conn.closed:
+                        renew_conn = connect(args)
+                    with holding(args, [id], worker, renew_conn) as lost:
+                        output = fn(item, payload)
+                    if lost.is_set():
+                        logger.warning("{} lost its lease on {} while working on it".format(worker, item))
+
+                    if not complete(conn, id, worker, {"host": socket.gethostname(), "output": os.path.abspath(output)}):
+                        logger.warning("{} was reclaimed by another worker so {} was not recorded as its result".format(item, output))
+                except Exception as e:
+                    logger.error("could not get data for {}: {}".format(item, e))
+                    fail(conn, id, worker, str(e), args.queue_attempts)
+    finally:
+        renew_conn.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="crawl_queue",
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument("command", choices=["status", "retry"], help="show progress for a job or put its failed items back in the queue")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.queue_job is None:
+        parser.error("--queue-job is required")
+
+    conn = connect(args)
+    try:
+        with conn.cursor() as cur:
+            if args.command == "retry":
+                cur.execute("""
+                    UPDATE public.crawl_queue SET status = 'pending', attempts = 0, leased_by = NULL, leased_until = NULL
+                    WHERE job = %(job)s AND status = 'failed'
+                """, {"job": args.queue_job})
+                print("requeued {} failed items".format(cur.rowcount), file=sys.stderr)
+                conn.commit()
+
+            cur.execute("""
+                SELECT
+                    CASE WHEN status = 'leased' AND leased_until < now() THEN 'expired' ELSE status END AS state,
+                    count(*), count(DISTINCT leased_by)
+                FROM public.crawl_queue
+                WHERE job = %(job)s
+                GROUP BY 1
+                ORDER BY 1
+            """, {"job": args.queue_job})
+            print("status,items,workers")
+            for state, items, workers in cur.fetchall():
+                print("{},{},{}".format(state, items, workers))
+
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
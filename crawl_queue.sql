@@ -0,0 +1,18 @@
+CREATE TABLE public.crawl_queue (
+    id bigserial not null,
+    job text not null,
+    item text not null,
+    payload jsonb not null,
+    status text not null default 'pending',
+    attempts int not null default 0,
+    leased_by text,
+    leased_until timestamp with time zone,
+    created_at timestamp with time zone not null default now(),
+    finished_at timestamp with time zone,
+    result jsonb,
+    error text,
+    primary key (id),
+    unique (job, item)
+);
+
+CREATE INDEX crawl_queue_claim_idx ON public.crawl_queue (job, status, leased_until);
@@ -0,0 +1,114 @@
+# the users that are embedded in every tweet are most of its size so only keep what gets used
+USER_FIELDS = [
+    "id_str", "screen_name", "name", "description", "location", "lang", "verified", "created_at",
+    "followers_count", "friends_count", "statuses_count", "favourites_count",
+]
+
+# these are the fields that load_networks.py reads out of each tweet
+ANALYSIS_FIELDS = [
+    "id_str", "created_at", "full_text", "truncated", "source", "lang",
+    "in_reply_to_status_id_str", "in_reply_to_user_id_str", "in_reply_to_screen_name",
+    "retweet_count", "favorite_count", "reply_count",
+    "entities.hashtags", "entities.urls",
+    "extended_tweet.full_text", "extended_tweet.entities.hashtags", "extended_tweet.entities.urls",
+    "retweeted_status", "quoted_status",
+] + ["user.{}".format(x) for x in USER_FIELDS]
+
+IDS_FIELDS = [
+    "id_str", "created_at", "user.id_str",
+    "in_reply_to_status_id_str", "in_reply_to_user_id_str",
+    "retweeted_status", "quoted_status",
+]
+
+# tweets that are embedded inside of a tweet get projected with the same fields as the tweet itself
+NESTED_STATUSES = ("retweeted_status", "quoted_status")
+
+# loadable says whether load_networks.py can load tweets saved with the profile. ids-only drops the text, source and
+# language that every row of the tweet table needs.
+PROFILES = {
+    "full": {
+        "trim_user": False,
+        "include_entities": True,
+        "fields": None,
+        "loadable": True,
+    },
+    "analysis": {
+        "trim_user": False,
+        "include_entities": True,
+        "fields": ANALYSIS_FIELDS,
+        "loadable": True,
+    },
+    "ids-only": {
+        "trim_user": True,
+        "include_entities": False,
+        "fields": IDS_FIELDS,
+        "loadable": False,
+    },
+}
+
+
+def add_arguments(parser):
+    parser.add_argument("--fetch-profile", dest="fetch_profile", choices=sorted(PROFILES), default="full", help="which fields of each tweet to request and keep")
+
+
+def compile_fields(fields):
+    # turns ["a.b", "a.c", "d"] into {"a": {"b": None, "c": None}, "d": None}
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            if node.get(part, {}) is None:
+                break  # the whole parent is already being kept
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def project(obj, tree, root=None):
+    if root is None:
+        root = tree
+
+    result = {}
+    for key, subtree in tree.items():
+        if key not in obj:
+            continue
+
+        value = obj[key]
+        if key in NESTED_STATUSES and subtree is None and isinstance(value, dict):
+            result[key] = project(value, root, root)
+        elif subtree is None or not isinstance(value, dict):
+            result[key] = value
+        else:
+            result[key] = project(value, subtree, root)
+    return result
+
+
+class FetchProfile:
+    def __init__(self, name):
+        profile = PROFILES[name]
+        self.name = name
+        self.trim_user = profile["trim_user"]
+        self.include_entities = profile["include_entities"]
+        self.loadable = profile["loadable"]
+        self.tree = compile_fields(profile["fields"]) if profile["fields"] is not None else None
+
+    def lookup_params(self, trim_user=None):
+        # only send what differs from twitter's defaults. statuses/lookup takes both options.
+        params = self.timeline_params(trim_user)
+        if not self.include_entities:
+            params["include_entities"] = "false"
+        return params
+
+    def timeline_params(self, trim_user=None):
+        # statuses/user_timeline has no include_entities option
+        params = {}
+        if (self.trim_user if trim_user is None else trim_user):
+            params["trim_user"] = "true"
+        return params
+
+    def apply(self, tweet):
+        if self.tree is None:
+            return tweet
+        return project(tweet, self.tree)
@@ -1,5 +1,13 @@
 import argparse
+import compression
+import crawl_plan
+import crawl_queue
+import fetch_profiles
+import getpass
+import load_networks
 import logging
+import psycopg2
+import response_archive
 import json
 import os
 import sys
@@ -8,7 +16,7 @@ import tweepy
 from tweepy import TweepError
 from datetime import datetime
 from queue import Queue
-from threading import Thread
+from threading import Event, Thread
 from tenacity import Retrying, stop_after_attempt
 from glob import glob
 
@@ -25,8 +33,27 @@ def main():
     parser.add_argument("--fetch-tweets", dest="fetch_tweets", action="store_true", help="set this flag to fetch all tweets for each account")
     parser.add_argument("--fetch-friends", dest="fetch_friends", action="store_true", help="set this flag to fetch all friends for each account")
     parser.add_argument("--fetch-followers", dest="fetch_followers", action="store_true", help="set this flag to fetch all followers for each account")
+    parser.add_argument("--sink", choices=["file", "postgres"], default="file", help="write each account to a file or straight into the tables that load_networks.py loads")
+    parser.add_argument("--sink-host", dest="sink_host", help="the database cluster to write into with --sink postgres", default="venus.lab.cip.uw.edu")
+    parser.add_argument("--sink-database", dest="sink_database", help="the database to write into with --sink postgres", default=getpass.getuser())
+    parser.add_argument("--sink-username", dest="sink_username", help="the name of the user to use when connecting to the database", default=getpass.getuser())
+    parser.add_argument("--sink-prefix", dest="sink_prefix", help="the prefix of the database tables to write into", default="network")
+    parser.add_argument("--sink-queue-size", dest="sink_queue_size", type=int, help="how many fetched pages may wait to be written before fetching pauses", default=100)
+    crawl_queue.add_arguments(parser)
+    crawl_plan.add_arguments(parser)
+    fetch_profiles.add_arguments(parser)
+    compression.add_arguments(parser, default="none")
+    response_archive.add_arguments(parser)
     args = parser.parse_args()
 
+    # the files get_networks.py writes are meant for load_networks.py, which needs more of each tweet than some profiles keep
+    if args.fetch_tweets and args.sink == "file" and not fetch_profiles.PROFILES[args.fetch_profile]["loadable"]:
+        parser.error("load_networks.py can't load tweets saved with --fetch-profile {}. use analysis or full with --fetch-tweets.".format(args.fetch_profile))
+
+    # the sink writes tweets into the same tables, so find out now rather than on the first page of every account
+    if args.fetch_tweets and args.sink == "postgres" and not fetch_profiles.PROFILES[args.fetch_profile]["loadable"]:
+        parser.error("--sink postgres can't write tweets fetched with --fetch-profile {}. use analysis or full with --fetch-tweets.".format(args.fetch_profile))
+
     # configure logging
     logging.captureWarnings(True)
     logger = logging.getLogger()
@@ -37,41 +64,271 @@ def main():
 
     # start the main program
     try:
-        # each file name matches an id that has been loaded
-        loaded = [os.path.split(x)[1].split(".", -1)[0] for x in glob(os.path.join(args.output, "*")) if (x.endswith(".json"))]
-
-        accounts = Queue()
-        with open(args.accounts, "rt") as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith("#"):
-                    continue
-                if line not in loaded:
-                    accounts.put(line)
-                else:
-                    logger.info("skipping {} because it already exists".format(line))
-
-        credentials = []
-        with open(args.credentials, "rt") as f:
-            credentials = json.load(f)
-        logger.info("found {} credentials to use".format(len(credentials)))
-
-        threads = []
-        for credential in credentials:
-            t = Thread(args=(accounts, credential, args.output, args.fetch_tweets, args.fetch_friends, args.fetch_followers), target=process_account)
-            threads.append(t)
-            t.start()
-
-        for t in threads:
-            t.join()
-
-        return 0
+        response_archive.install(args)
+
+        if args.dry_run:
+            return main_plan(args)
+
+        sink = None
+        if args.sink == "postgres":
+            sink = PostgresSink(args.sink_host, args.sink_database, args.sink_username, args.sink_prefix, args.sink_queue_size)
+            sink.start()
+
+        writer = compression.Writer(args.compression, args.compression_level, args.output)
+
+        try:
+            if args.queue_job is not None:
+                return main_queue(args, sink, writer)
+            return main_accounts(args, sink, writer)
+        finally:
+            if sink is not None:
+                sink.close()
     except Exception:
         logger.error(traceback.format_exc())
         return 1
 
 
-def process_account(queue, credentials, output, fetch_tweets, fetch_friends, fetch_followers):
+def pending_accounts(args):
+    logger = logging.getLogger()
+
+    # each file name matches an id that has been loaded
+    loaded = [os.path.split(x)[1].split(".", -1)[0] for x in glob(os.path.join(args.output, "*")) if compression.strip_extension(x).endswith(".json")]
+
+    pending = []
+    with open(args.accounts, "rt") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line not in loaded:
+                pending.append(line)
+            else:
+                logger.info("skipping {} because it already exists".format(line))
+    return pending
+
+
+def main_accounts(args, sink, writer):
+    logger = logging.getLogger()
+
+    pending = pending_accounts(args)
+
+    credentials = []
+    with open(args.credentials, "rt") as f:
+        credentials = json.load(f)
+    logger.info("found {} credentials to use".format(len(credentials)))
+
+    if args.plan:
+        pending = [x["account"] for x in plan_accounts(args, pending, credentials)]
+
+    accounts = Queue()
+    for account in pending:
+        accounts.put(account)
+
+    profile = fetch_profiles.FetchProfile(args.fetch_profile)
+
+    threads = []
+    for credential in credentials:
+        t = Thread(args=(accounts, credential, args.output, args.fetch_tweets, args.fetch_friends, args.fetch_followers, profile, sink, writer), target=process_account)
+        threads.append(t)
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return 0
+
+
+class SinkAccount:
+    def __init__(self, account: str, collected_at: str):
+        self.account = account
+        self.collected_at = collected_at
+        self.done = Event()
+        self.error = None
+
+
+class PostgresSink:
+    # writes pages into the load_networks.py tables as they are fetched. the queue is bounded so that
+    # fetching waits for the database instead of piling pages up in memory.
+    def __init__(self, host: str, database: str, username: str, prefix: str, queue_size: int):
+        self.host = host
+        self.database = database
+        self.username = username
+        self.prefix = prefix
+        self.queue = Queue(maxsize=queue_size)
+        self.conn = None
+        self.thread = None
+
+    def start(self):
+        # connect here so that a bad connection stops everything before any fetching starts
+        self.conn = psycopg2.connect(host=self.host, dbname=self.database, user=self.username)
+        with self.conn.cursor() as cur:
+            load_networks.create_staging(cur, self.prefix)
+        self.conn.commit()
+
+        self.thread = Thread(target=self.run)
+        self.thread.start()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.conn.close()
+
+    def begin(self, record: dict) -> SinkAccount:
+        state = SinkAccount(record["id"], record["captured_at"])
+        self.queue.put(("user", state, record))
+        return state
+
+    def put(self, state: SinkAccount, kind: str, rows: list):
+        # once a page has failed the rest of the account would be dropped anyway, so stop fetching it
+        if state.error is not None:
+            raise state.error
+        self.queue.put((kind, state, rows))
+
+    def finish(self, state: SinkAccount, followers_collected: int = None, friends_collected: int = None):
+        self.queue.put(("finish", state, (followers_collected, friends_collected)))
+        state.done.wait()
+        if state.error is not None:
+            raise state.error
+
+    def run(self):
+        logger = logging.getLogger()
+
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+
+            kind, state, rows = message
+            if state.error is None:
+                try:
+                    with self.conn.cursor() as cur:
+                        self.write(cur, kind, state, rows)
+                    self.conn.commit()
+                except Exception as e:
+                    logger.error("could not write {} for {}: {}".format(kind, state.account, e))
+                    logger.error(traceback.format_exc())
+                    try:
+                        self.conn.rollback()
+                    except Exception:
+                        pass
+                    state.error = e
+
+            if kind == "finish":
+                state.done.set()
+
+    def write(self, cur, kind: str, state: SinkAccount, rows):
+        if kind == "user":
+            load_networks.insert_user(cur, self.prefix, load_networks.process_user(rows), state.collected_at)
+            return
+
+        if kind == "finish":
+            followers_collected, friends_collected = rows
+            cur.execute(f"""
+                UPDATE public.{self.prefix}_user SET
+                    followers_collected = %(followers_collected)s,
+                    friends_collected = %(friends_collected)s
+                WHERE id = %(id)s AND collected_at = %(collected_at)s
+            """, {
+                "id": state.account,
+                "collected_at": state.collected_at,
+                "followers_collected": followers_collected,
+                "friends_collected": friends_collected,
+            })
+            return
+
+        tables = {"friends": "user_friend", "followers": "user_follower", "tweets": "tweet"}
+        if kind == "friends":
+            generator = (
+                load_networks.clean_line(x.values())
+                for x in load_networks.process_user_friend(state.account, state.collected_at, rows)
+            )
+            cur.copy_expert("COPY staging_user_friend FROM STDIN WITH CSV", load_networks.StringIteratorIO(generator))
+
+        if kind == "followers":
+            generator = (
+                load_networks.clean_line(x.values())
+                for x in load_networks.process_user_follower(state.account, state.collected_at, rows)
+            )
+            cur.copy_expert("COPY staging_user_follower FROM STDIN WITH CSV", load_networks.StringIteratorIO(generator))
+
+        if kind == "tweets":
+            generator = (
+                load_networks.clean_nullable_line(load_networks.process_tweet(x))
+                for x in rows
+            )
+            cur.copy_expert(f"COPY staging_tweet ({', '.join(load_networks.TWEET_COLUMNS)}) FROM STDIN WITH {load_networks.COPY_NULLABLE}", load_networks.StringIteratorIO(generator))
+
+        load_networks.merge_staging(cur, self.prefix, [tables[kind]])
+
+
+def plan_accounts(args, accounts, credentials):
+    logger = logging.getLogger()
+    logger.info("planning {} accounts".format(len(accounts)))
+
+    return crawl_plan.plan(crawl_plan.get_apis(credentials), accounts, args.fetch_tweets, args.fetch_friends, args.fetch_followers)
+
+
+def main_plan(args):
+    # plan what a real run would fetch, which leaves out the accounts that are already done
+    accounts = pending_accounts(args)
+
+    credentials = []
+    with open(args.credentials, "rt") as f:
+        credentials = json.load(f)
+
+    crawl_plan.print_plan(plan_accounts(args, accounts, credentials))
+    return 0
+
+
+def main_queue(args, sink, writer):
+    logger = logging.getLogger()
+
+    # every worker enqueues the same accounts file so it does not matter which host starts first
+    accounts = []
+    with open(args.accounts, "rt") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            accounts.append((line, {"account": line}))
+
+    credentials = []
+    with open(args.credentials, "rt") as f:
+        credentials = json.load(f)
+    logger.info("found {} credentials to use".format(len(credentials)))
+
+    if args.plan:
+        accounts = [(x["account"], {"account": x["account"]}) for x in plan_accounts(args, [x[0] for x in accounts], credentials)]
+
+    conn = crawl_queue.connect(args)
+    try:
+        crawl_queue.enqueue(conn, args.queue_job, accounts)
+    finally:
+        conn.close()
+    logger.info("enqueued {} accounts for job {}".format(len(accounts), args.queue_job))
+
+    profile = fetch_profiles.FetchProfile(args.fetch_profile)
+
+    threads = []
+    for credential in credentials:
+        t = Thread(args=(args, credential, profile, sink, writer), target=process_queue)
+        threads.append(t)
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return 0
+
+
+def process_queue(args, credentials, profile, sink, writer):
+    def fetch(account, payload):
+        return fetch_account(account, credentials, args.output, args.fetch_tweets, args.fetch_friends, args.fetch_followers, profile, sink, writer)
+
+    crawl_queue.work(args, crawl_queue.worker_name(credentials["consumer_key"]), fetch)
+
+
+def process_account(queue, credentials, output, fetch_tweets, fetch_friends, fetch_followers, profile, sink, writer):
     logger = logging.getLogger()
 
     while not queue.empty():
@@ -83,12 +340,12 @@ def process_account(queue, credentials, output, fetch_tweets, fetch_friends, fet
             logger.info("processing {} with {}".format(account, credentials["consumer_key"]))
             #for attempt in Retrying(reraise=True, stop=stop_after_attempt(5)):
             #    with attempt:
-            fetch_account(account, credentials, output, fetch_tweets, fetch_friends, fetch_followers)
+            fetch_account(account, credentials, output, fetch_tweets, fetch_friends, fetch_followers, profile, sink, writer)
         except Exception as e:
             logger.error("could not get data for {}: {}".format(account, e))
 
 
-def fetch_account(account, credentials, output, fetch_tweets, fetch_friends, fetch_followers):
+def fetch_account(account, credentials, output, fetch_tweets, fetch_friends, fetch_followers, profile, sink=None, writer=None):
     logger = logging.getLogger()
 
     api = None
@@ -118,78 +375,134 @@ def fetch_account(account, credentials, output, fetch_tweets, fetch_friends, fet
             with open("{}.tmp".format(file_name), "wt") as f:
                 print(json.dumps({
                     "id": account,
-                    "captured_at": str(datetime.now()),
+                    "captured_at": str(response_archive.now()),
                     "unknown": True
                 }, indent=4), file=f)
             os.rename("{}.tmp".format(file_name), file_name)
-            return
+            return file_name
 
         if e.api_code == 63:
             logger.info("finished fetching suspended account {}".format(account))
             with open("{}.tmp".format(file_name), "wt") as f:
                 print(json.dumps({
                     "id": account,
-                    "captured_at": str(datetime.now()),
+                    "captured_at": str(response_archive.now()),
                     "suspended": True
                 }, indent=4), file=f)
             os.rename("{}.tmp".format(file_name), file_name)
-            return
+            return file_name
 
         raise
 
     if obj.protected:
         logger.info("finished fetching protected account {}".format(account))
+        record = {
+            "id": data["id_str"],
+            "screen_name": data["screen_name"],
+            "captured_at": str(response_archive.now()),
+            "created_at": str(datetime.strptime(data["created_at"], "%a %b %d %H:%M:%S +0000 %Y")),  # Sat Dec 31 04:34:35 +0000 2011
+            "favorites_count": data["favourites_count"],
+            "tweet_count": data["statuses_count"],
+            "protected": True
+        }
+        if sink is not None:
+            sink.finish(sink.begin(dict(record)))
+            record["sink"] = "postgres"
+
         with open("{}.tmp".format(file_name), "wt") as f:
-            print(json.dumps({
-                "id": data["id_str"],
-                "screen_name": data["screen_name"],
-                "captured_at": str(datetime.now()),
-                "created_at": str(datetime.strptime(data["created_at"], "%a %b %d %H:%M:%S +0000 %Y")),  # Sat Dec 31 04:34:35 +0000 2011
-                "favorites_count": data["favourites_count"],
-                "tweet_count": data["statuses_count"],
-                "protected": True
-            }, indent=4), file=f)
+            print(json.dumps(record, indent=4), file=f)
         os.rename("{}.tmp".format(file_name), file_name)
-        return
+        return file_name
+
+    record = {
+        "id": data["id_str"],
+        "screen_name": data["screen_name"],
+        "captured_at": str(response_archive.now()),
+        "created_at": str(datetime.strptime(data["created_at"], "%a %b %d %H:%M:%S +0000 %Y")),  # Sat Dec 31 04:34:35 +0000 2011
+        "favorites_count": data["favourites_count"],
+        "tweet_count": data["statuses_count"],
+    }
+
+    # with a sink every page is handed off as soon as it arrives instead of piling up here
+    state = None
+    if sink is not None:
+        state = sink.begin({**record, "user": dict(data)})
 
     tweets = None
+    tweets_collected = None
     if fetch_tweets:
         tweets = []
-        for page in tweepy.Cursor(api.user_timeline, user_id=obj.id, stringify_ids=True, tweet_mode="extended", count=3200).pages():
+        tweets_collected = 0
+        for page in tweepy.Cursor(api.user_timeline, user_id=obj.id, stringify_ids=True, tweet_mode="extended", count=3200, **profile.timeline_params()).pages():
             logger.info("fetching tweets page for {}".format(obj.id))
+            results = []
             for tweet in page:
-                tweets.append(tweet._json)
+                tweet = profile.apply(tweet._json)
+                if profile.tree is not None and "screen_name" in tweet.get("user", {}):
+                    # the full user is already saved once below so don't repeat it in every tweet
+                    tweet["user"] = {"id_str": tweet["user"]["id_str"], "screen_name": tweet["user"]["screen_name"]}
+                results.append(tweet)
+
+            tweets_collected += len(results)
+            if state is not None:
+                sink.put(state, "tweets", results)
+            else:
+                tweets += results
 
     # max per page is 5000
     followers = None
+    followers_collected = None
     if fetch_followers:
         followers = []
+        followers_collected = 0
         for page in tweepy.Cursor(api.followers_ids, user_id=obj.id, stringify_ids=True, count=5000).pages():
-            followers += page
+            followers_collected += len(page)
+            if state is not None:
+                sink.put(state, "followers", page)
+            else:
+                followers += page
 
     # max per page is 5000
     friends = None
+    friends_collected = None
     if fetch_friends:
         friends = []
+        friends_collected = 0
         for page in tweepy.Cursor(api.friends_ids, user_id=obj.id, stringify_ids=True, count=5000).pages():
-            friends += page
+            friends_collected += len(page)
+            if state is not None:
+                sink.put(state, "friends", page)
+            else:
+                friends += page
 
     logger.info("finished fetching {}".format(account))
-    with open(os.path.join(output, "{}.json".format(account)), "wt") as f:
-        print(json.dumps({
-            "id": data["id_str"],
-            "screen_name": data["screen_name"],
-            "captured_at": str(datetime.now()),
-            "created_at": str(datetime.strptime(data["created_at"], "%a %b %d %H:%M:%S +0000 %Y")),  # Sat Dec 31 04:34:35 +0000 2011
-            "favorites_count": data["favourites_count"],
-            "tweet_count": data["statuses_count"],
+    if state is not None:
+        # only leave a file behind once everything is in the database so that a rerun picks up where this stopped
+        sink.finish(state, followers_collected, friends_collected)
+        record.update({
+            "sink": "postgres",
+            "friends_collected": friends_collected,
+            "followers_collected": followers_collected,
+            "tweets_collected": tweets_collected,
+        })
+    else:
+        record.update({
+            "captured_at": str(response_archive.now()),
             "friend_ids": friends,
             "follower_ids": followers,
             "tweets": tweets,
             "user": data,
-        }, indent=4), file=f)
+        })
+
+    if writer is None:
+        writer = compression.Writer("none")
+
+    file_name = os.path.join(output, "{}.json{}".format(account, writer.extension()))
+    with writer.open(file_name) as f:
+        print(json.dumps(record, indent=4), file=f)
 
     logger.info("finished processing {}".format(account))
+    return file_name
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 import argparse
 import logging
+import response_archive
+import sqlite3
 import sys
 import traceback
 import tweepy
@@ -7,6 +9,61 @@ import json
 from datetime import datetime
 
 
+# the counters that decide whether an account has changed since the last run
+COUNTERS = ["followers", "friends", "favorites", "statuses"]
+
+
+def open_state(path):
+    # every change to an account is one row so the table grows with changes and not with runs
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            user_id TEXT NOT NULL,
+            captured_at TEXT NOT NULL,
+            screen_name TEXT,
+            created_at TEXT,
+            followers INTEGER,
+            friends INTEGER,
+            favorites INTEGER,
+            statuses INTEGER,
+            PRIMARY KEY (user_id, captured_at)
+        ) WITHOUT ROWID
+    """)
+    return conn
+
+
+def latest_counters(conn, captured_at=None):
+    # the last known row for every account, optionally as of some time in the past
+    rows = conn.execute("""
+        SELECT c.user_id, c.screen_name, c.captured_at, c.created_at, c.followers, c.friends, c.favorites, c.statuses
+        FROM counters c
+        JOIN (
+            SELECT user_id, max(captured_at) AS captured_at
+            FROM counters
+            WHERE ? IS NULL OR captured_at <= ?
+            GROUP BY user_id
+        ) l ON c.user_id = l.user_id AND c.captured_at = l.captured_at
+    """, (captured_at, captured_at))
+
+    latest = {}
+    for row in rows:
+        latest[row[0]] = dict(zip(["user_id", "screen_name", "captured_at", "created_at"] + COUNTERS, row))
+    return latest
+
+
+def print_row(row):
+    print(",".join([
+        row["user_id"],
+        row["screen_name"],
+        row["captured_at"],
+        row["created_at"],
+        str(row["followers"]),
+        str(row["friends"]),
+        str(row["favorites"]),
+        str(row["statuses"]),
+    ]))
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="get_statistics",
@@ -15,8 +72,24 @@ def main():
     )
     parser.add_argument("credentials", help="a json file containing credentials to use")
     parser.add_argument("accounts", help="a file containing account ids")
+    parser.add_argument("--state", help="a file that keeps the last known counters for each account. only accounts whose counters changed are printed.")
+    parser.add_argument("--snapshot-at", dest="snapshot_at", help="print every account as it was at this time from the --state file without fetching anything, such as \"2023-01-01 12:00:00\"")
+    response_archive.add_arguments(parser)
     args = parser.parse_args()
 
+    if args.snapshot_at is not None and args.state is None:
+        parser.error("--snapshot-at needs --state")
+
+    # captured_at is stored as str(datetime) in local time, so the time it is compared to has to look the same
+    if args.snapshot_at is not None:
+        try:
+            snapshot_at = datetime.fromisoformat(args.snapshot_at)
+        except ValueError:
+            parser.error("--snapshot-at must look like \"2023-01-01 12:00:00\", not \"{}\"".format(args.snapshot_at))
+        if snapshot_at.tzinfo is not None:
+            snapshot_at = snapshot_at.astimezone().replace(tzinfo=None)
+        args.snapshot_at = str(snapshot_at)
+
     # configure logging
     logging.captureWarnings(True)
     logger = logging.getLogger()
@@ -27,6 +100,17 @@ def main():
 
     # start the main program
     try:
+        state = None
+        latest = {}
+        if args.state is not None:
+            state = open_state(args.state)
+            latest = latest_counters(state, args.snapshot_at)
+
+        if args.snapshot_at is not None:
+            return main_snapshot(args, latest)
+
+        response_archive.install(args)
+
         credentials = []
         with open(args.credentials, "rt") as f:
             credentials = json.load(f)
@@ -49,6 +133,7 @@ def main():
 
         print("user_id,user_screen_name,captured_at,created_at,followers,friends,favorites,statuses")
         api_key = 0
+        changed = 0
         for account in accounts:
             api = apis[api_key][0]
             api_key = api_key + 1
@@ -58,24 +143,64 @@ def main():
             try:
                 obj = api.get_user(id=account.strip('"').strip("'").strip())
                 data = obj._json
-                print(",".join([
-                    data["id_str"],
-                    data["screen_name"],
-                    str(datetime.now()),
-                    data["created_at"],
-                    str(data["followers_count"]),
-                    str(data["friends_count"]),
-                    str(data["favourites_count"]),
-                    str(data["statuses_count"]),
-                ]))
+                row = {
+                    "user_id": data["id_str"],
+                    "screen_name": data["screen_name"],
+                    "captured_at": str(response_archive.now()),
+                    "created_at": data["created_at"],
+                    "followers": data["followers_count"],
+                    "friends": data["friends_count"],
+                    "favorites": data["favourites_count"],
+                    "statuses": data["statuses_count"],
+                }
+
+                if state is not None:
+                    last = latest.get(row["user_id"])
+                    if last is not None and all(last[x] == row[x] for x in COUNTERS):
+                        continue
+
+                    state.execute("""
+                        INSERT OR REPLACE INTO counters (user_id, captured_at, screen_name, created_at, followers, friends, favorites, statuses)
+                        VALUES (:user_id, :captured_at, :screen_name, :created_at, :followers, :friends, :favorites, :statuses)
+                    """, row)
+                    latest[row["user_id"]] = row
+
+                    # don't lose a long run's changes if it gets interrupted
+                    changed += 1
+                    if changed % 1000 == 0:
+                        state.commit()
+
+                print_row(row)
             except Exception as e:
                 print("{},{}".format(account, e))
 
+        if state is not None:
+            state.commit()
+            state.close()
+
         return 0
     except Exception:
         logger.error(traceback.format_exc())
         return 1
 
 
+def main_snapshot(args, latest):
+    accounts = []
+    with open(args.accounts, "rt") as f:
+        for line in f:
+            line = line.strip().strip('"').strip("'").strip()
+            if not line or line.startswith("#"):
+                continue
+            accounts.append(line)
+
+    # each account shows the last values it had at that time and when they were captured
+    print("user_id,user_screen_name,captured_at,created_at,followers,friends,favorites,statuses")
+    for account in accounts:
+        if account in latest:
+            print_row(latest[account])
+
+    return 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
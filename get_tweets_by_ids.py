@@ -1,5 +1,9 @@
 import argparse
+import compression
+import crawl_queue
+import fetch_profiles
 import logging
+import response_archive
 import sys
 import traceback
 import tweepy
@@ -8,7 +12,6 @@ import os
 from queue import Queue
 from tweepy import TweepError
 from threading import Thread
-import gzip
 
 # configure logging
 logging.captureWarnings(True)
@@ -26,23 +29,23 @@ def get_ids(input):
             tweet_ids.append(line)
     return tweet_ids
 
-def get_one_batch(tweet_ids, credentials, output):
+def get_one_batch(tweet_ids, credentials, output, profile, writer):
     try:
         auth = tweepy.OAuthHandler(credentials["consumer_key"], credentials["consumer_secret"])
         auth.set_access_token(credentials["access_token"], credentials["access_token_secret"])
         api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
 
-        write_file = os.path.join(output, "{}.json.gz".format(tweet_ids[0]))
+        write_file = os.path.join(output, "{}.json{}".format(tweet_ids[0], writer.extension()))
         if os.path.exists(write_file):
             logger.info("data already fetched {}".format(write_file))
-            return
+            return write_file
 
         results = []
-        tweets = api.statuses_lookup(tweet_ids, tweet_mode="extended")
+        tweets = api.statuses_lookup(tweet_ids, tweet_mode="extended", **profile.lookup_params())
         for tweet in tweets:
-            results.append(tweet._json)
+            results.append(profile.apply(tweet._json))
 
-        with gzip.open(write_file, 'wt') as f:
+        with writer.open(write_file) as f:
             for tweet in results:
                 f.write(json.dumps(tweet, default=str, ensure_ascii=False))
                 f.write("\n")
@@ -52,9 +55,9 @@ def get_one_batch(tweet_ids, credentials, output):
         logger.error(traceback.format_exc())
         raise
 
-    return
+    return write_file
 
-def get_tweets(queue, credentials, output):
+def get_tweets(queue, credentials, output, profile, writer):
     logger = logging.getLogger()
 
     while not queue.empty():
@@ -63,7 +66,7 @@ def get_tweets(queue, credentials, output):
             continue
         try:
             logger.info("processing {} with {}".format(tweet_ids[:5], credentials["consumer_key"]))
-            get_one_batch(tweet_ids, credentials, output)
+            get_one_batch(tweet_ids, credentials, output, profile, writer)
         except Exception as e:
             logger.error("could not get data for {}: {}".format(tweet_ids[:5], e))
     return
@@ -72,7 +75,46 @@ def split(list_a, chunk_size=100):
   for i in range(0, len(list_a), chunk_size):
     yield tuple(list_a[i:i + chunk_size])
 
-def batch_get_tweets(credential_file, input, output):
+def get_queued_tweets(args, credentials):
+    profile = fetch_profiles.FetchProfile(args.fetch_profile)
+    writer = compression.Writer(args.compression, args.compression_level, args.output)
+
+    def fetch(item, tweet_ids):
+        return get_one_batch(tweet_ids, credentials, args.output, profile, writer)
+
+    crawl_queue.work(args, crawl_queue.worker_name(credentials["consumer_key"]), fetch)
+    return
+
+def queue_get_tweets(args):
+    credentials = []
+    with open(args.credentials, "rt") as f:
+        credentials = json.load(f)
+    logger.info("found {} credentials to use".format(len(credentials)))
+
+    # every worker enqueues the same batches so it does not matter which host starts first
+    tweet_ids_chunks = list(split(get_ids(args.input), 100))
+    conn = crawl_queue.connect(args)
+    try:
+        crawl_queue.enqueue(conn, args.queue_job, [(chunk[0], list(chunk)) for chunk in tweet_ids_chunks])
+    finally:
+        conn.close()
+    logger.info("enqueued {} chunks for job {}".format(len(tweet_ids_chunks), args.queue_job))
+
+    threads = []
+    for credential in credentials:
+        t = Thread(args=(args, credential), target=get_queued_tweets)
+        threads.append(t)
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return
+
+def batch_get_tweets(credential_file, input, output, profile_name="full", codec="gzip", level=None):
+    profile = fetch_profiles.FetchProfile(profile_name)
+    writer = compression.Writer(codec, level, output)
+
     credentials = []
     with open(credential_file, "rt") as f:
         credentials = json.load(f)
@@ -90,7 +132,7 @@ def batch_get_tweets(credential_file, input, output):
 
     threads = []
     for credential in credentials:
-        t = Thread(args=(queue, credential, output), target=get_tweets)
+        t = Thread(args=(queue, credential, output, profile, writer), target=get_tweets)
         threads.append(t)
         t.start()
 
@@ -108,9 +150,18 @@ def main():
     parser.add_argument("credentials", help="a json file containing credentials to use")
     parser.add_argument("input", help="a file containing all tweet ids")
     parser.add_argument("output", help="a directory to place the output files, one per user id")
+    crawl_queue.add_arguments(parser)
+    fetch_profiles.add_arguments(parser)
+    compression.add_arguments(parser)
+    response_archive.add_arguments(parser)
     args = parser.parse_args()
+    response_archive.install(args)
+
+    if args.queue_job is not None:
+        queue_get_tweets(args)
+        return
 
-    batch_get_tweets(args.credentials, args.input, args.output)
+    batch_get_tweets(args.credentials, args.input, args.output, args.fetch_profile, args.compression, args.compression_level)
     return
 
 if __name__ == '__main__':
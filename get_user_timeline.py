@@ -1,14 +1,16 @@
 import argparse
+import compression
+import fetch_profiles
 import logging
 from logging.handlers import RotatingFileHandler
 import os.path
+import response_archive
 import sys
 import time
 import traceback
 import tweepy
 import json
 from datetime import datetime
-import gzip
 
 # configure logging
 logging.captureWarnings(True)
@@ -44,30 +46,32 @@ def get_API(c):
     api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
     return api
 
-def fetch_user_timeline(api, account_id, outputfile):
+def fetch_user_timeline(api, account_id, outputfile, profile, writer):
     # Only iterate through the first 3 pages
-    f = gzip.open(outputfile, 'wt')
-    for item in tweepy.Cursor(api.user_timeline, account_id, count=200, tweet_mode="extended").items(3200): #max is 3200
+    f = writer.open(outputfile)
+    for item in tweepy.Cursor(api.user_timeline, account_id, count=200, tweet_mode="extended", **profile.timeline_params()).items(3200): #max is 3200
         # TODO check matching tweets
-        jobj = item._json
+        jobj = profile.apply(item._json)
         print(json.dumps(jobj), file=f, flush=True)
     f.close()
     return
 
-def main(credential_file, account_file, output):
+def main(credential_file, account_file, output, profile_name="full", codec="gzip", level=None):
+    profile = fetch_profiles.FetchProfile(profile_name)
+    writer = compression.Writer(codec, level, output)
     credentials = get_credentials(credential_file)
     api = get_API(credentials)
     timestamp = "20221214" #20221214
     accounts = get_accounts(account_file)
     logger.info('total number of accounts=%s'%len(accounts))
     for account in accounts:
-        output_file = os.path.join(output, "%s_%s.json.gz"%(account, timestamp))
+        output_file = os.path.join(output, "%s_%s.json%s"%(account, timestamp, writer.extension()))
         if os.path.exists(output_file):
             continue
         # print('output file', output_file)
         logger.info("output file: %s"%output_file)
         try:
-            fetch_user_timeline(api, account, output_file)
+            fetch_user_timeline(api, account, output_file, profile, writer)
         except Exception as e:
             logger.error("an error occurred while writing a line: {}".format(e))
             logger.error(traceback.format_exc())
@@ -84,11 +88,15 @@ if __name__ == '__main__':
     parser.add_argument("credentials", help="a json file containing credentials to use")
     parser.add_argument("accounts", help="a file containing account names")
     parser.add_argument("output", help="output directory")
+    fetch_profiles.add_arguments(parser)
+    compression.add_arguments(parser)
+    response_archive.add_arguments(parser)
     args = parser.parse_args()
+    response_archive.install(args)
 
     credential_file = args.credentials
     account_file = args.accounts
     output = args.output
 
-    main(credential_file, account_file, output)
+    main(credential_file, account_file, output, args.fetch_profile, args.compression, args.compression_level)
     pass
\ No newline at end of file
@@ -1,12 +1,17 @@
 import argparse
+import compression
+import cProfile
 import csv
 import getpass
+import json
 import os
 import psycopg2
 import re
 import sys
+import time
 import traceback
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from glob import glob
 from html.parser import HTMLParser
 from io import TextIOBase, StringIO
@@ -15,6 +20,32 @@ from io import TextIOBase, StringIO
 # compile this for performance later in the module
 NULL_TERMINATOR = re.compile(r"(?<!\\)\\u0000")
 
+# rows for these tables are copied into temporary tables first and then merged in one statement
+STAGED_TABLES = ["user", "user_friend", "user_follower", "tweet"]
+
+# the order that process_embedded_user returns its values in
+USER_COLUMNS = [
+    "collected_at", "id", "screen_name", "name", "description", "language", "location", "created_at",
+    "followers_count", "friends_count", "statuses_count", "favorites_count", "verified", "raw",
+]
+
+# the order that process_tweet returns its values in
+TWEET_COLUMNS = [
+    "id", "created_at", "tweet", "source", "language", "user_id", "user_screen_name",
+    "in_reply_to_status_id", "in_reply_to_user_id", "in_reply_to_user_screen_name",
+    "retweeted_status_id", "retweeted_status_user_id", "retweeted_status_user_screen_name", "retweeted_status_user_name", "retweeted_status_user_description",
+    "retweeted_status_user_friends_count", "retweeted_status_user_statuses_count", "retweeted_status_user_followers_count",
+    "retweeted_status_retweet_count", "retweeted_status_favorite_count", "retweeted_status_reply_count",
+    "quoted_status_id", "quoted_status_user_id", "quoted_status_user_screen_name", "quoted_status_user_name", "quoted_status_user_description",
+    "quoted_status_user_friends_count", "quoted_status_user_statuses_count", "quoted_status_user_followers_count",
+    "quoted_status_retweet_count", "quoted_status_favorite_count", "quoted_status_reply_count",
+    "hashtags", "urls", "raw",
+]
+
+# used for rows where an empty string and a null are different things
+COPY_NULL = r"\N"
+COPY_NULLABLE = r"(FORMAT csv, NULL '\N')"
+
 
 def replace_null_terminators(text: str, replacement: str = r""):
     return NULL_TERMINATOR.sub(replacement, text) if text is not None else None
@@ -96,13 +127,144 @@ class StringIteratorIO(TextIOBase):
         return "".join(line)
 
 
+class StageProfiler:
+    # adds up the time spent in each part of the load. time spent in a stage that runs inside of another
+    # stage, like clean_line inside of a COPY, only counts towards the inner stage.
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.stack = []
+        self.mark = None
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.files = []
+        self.file_started = None
+
+    def enter(self, name: str):
+        now = time.perf_counter()
+        if self.stack:
+            self.seconds[self.stack[-1]] += now - self.mark
+        self.stack.append(name)
+        self.calls[name] += 1
+        self.mark = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.seconds[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def wrap(self, name: str, fn):
+        # for things called once per row. when profiling is off this costs nothing.
+        if not self.enabled:
+            return fn
+
+        def wrapped(*args, **kwargs):
+            self.enter(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.exit()
+        return wrapped
+
+    def stream(self, stream: TextIOBase):
+        if not self.enabled:
+            return stream
+
+        read = self.wrap("stream_read", stream.read)
+
+        def counted(n: int = None) -> str:
+            data = read(n)
+            self.counts["copy_bytes"] += len(data)
+            return data
+        stream.read = counted
+        return stream
+
+    def count(self, name: str, n: int):
+        if self.enabled:
+            self.counts[name] += n
+
+    def begin_file(self, input_file: str):
+        if self.enabled:
+            self.file_started = (input_file, time.perf_counter(), dict(self.seconds), dict(self.counts))
+
+    def end_file(self):
+        if not self.enabled:
+            return
+
+        input_file, started, seconds, counts = self.file_started
+        self.files.append({
+            "file": input_file,
+            "elapsed": time.perf_counter() - started,
+            "seconds": {k: v - seconds.get(k, 0) for k, v in self.seconds.items() if v > seconds.get(k, 0)},
+            "counts": {k: v - counts.get(k, 0) for k, v in self.counts.items() if v > counts.get(k, 0)},
+        })
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "elapsed": elapsed,
+            "seconds": {**self.seconds, "other": max(elapsed - sum(self.seconds.values()), 0)},
+            "calls": dict(self.calls),
+            "counts": dict(self.counts),
+            "files": self.files,
+        }
+
+    def print_summary(self, file=sys.stderr):
+        report = self.report()
+        elapsed = report["elapsed"] or 1
+
+        print("{:<16} {:>12} {:>8} {:>12}".format("stage", "seconds", "percent", "calls"), file=file)
+        for name, seconds in sorted(report["seconds"].items(), key=lambda x: -x[1]):
+            print("{:<16} {:>12.3f} {:>7.1f}% {:>12}".format(name, seconds, 100 * seconds / elapsed, report["calls"].get(name, "")), file=file)
+        print("{:<16} {:>12.3f} {:>7.1f}% {:>12}".format("total", report["elapsed"], 100.0, len(report["files"])), file=file)
+
+        print(file=file)
+        print("{:<16} {:>12} {:>12}".format("count", "total", "per second"), file=file)
+        for name, count in sorted(report["counts"].items()):
+            print("{:<16} {:>12} {:>12.0f}".format(name, count, count / elapsed), file=file)
+
+
+NO_PROFILER = StageProfiler(enabled=False)
+
+
 def main(**kwargs):
     if os.path.isfile(kwargs["input"]):
-        load(kwargs["host"], kwargs["database"], kwargs["username"], kwargs["prefix"], kwargs["input"])
+        input_files = [kwargs["input"]]
     else:
-        input_files = [x for x in glob(kwargs["input"]) if (x.endswith(".json") or x.endswith(".json.gz"))]
-        for input_file in input_files:
-            load(kwargs["host"], kwargs["database"], kwargs["username"], kwargs["prefix"], input_file)
+        input_files = [x for x in glob(kwargs["input"]) if compression.strip_extension(x).endswith(".json")]
+
+    profiler = StageProfiler() if (kwargs["profile"] or kwargs["profile_report"]) else NO_PROFILER
+
+    profile = cProfile.Profile() if kwargs["cprofile"] else None
+    if profile is not None:
+        profile.enable()
+
+    try:
+        load_batches(kwargs["host"], kwargs["database"], kwargs["username"], kwargs["prefix"], input_files,
+                     batch_files=kwargs["batch_files"], batch_rows=kwargs["batch_rows"], embedded_users=kwargs["embedded_users"], profiler=profiler)
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(kwargs["cprofile"])
+
+        if profiler.enabled:
+            profiler.print_summary()
+            if kwargs["profile_report"]:
+                with open(kwargs["profile_report"], "wt") as f:
+                    json.dump(profiler.report(), f, indent=4)
 
 
 def process_user_friend(user_id, collected_at, friend_ids):
@@ -123,6 +285,104 @@ def process_user_follower(user_id, collected_at, follower_ids):
         })
 
 
+def process_user(data):
+    user_obj = {}
+    if "user" in data:
+        user_obj = data["user"]
+        if "favourites_count" in user_obj:
+            user_obj["favorites_count"] = user_obj.pop("favourites_count")
+        if "lang" in user_obj:
+            user_obj["language"] = user_obj.pop("lang")
+    else:
+        user_obj = {
+            "id": data["id"],
+            "id_str": data["id"],
+            "screen_name": data["screen_name"],
+            "created_at": data["created_at"],
+            "name": None,
+            "description": None,
+            "language": None,
+            "location": None,
+            "verified": None,
+            "favorites_count": data["favorites_count"],
+            "statuses_count": data["tweet_count"],
+            "followers_count": None,
+            "friends_count": None,
+        }
+
+    return user_obj
+
+
+def process_embedded_users(tweet):
+    # the author of the tweet plus the authors of anything it retweets or quotes, however deep
+    yield tweet["user"]
+    for key in ["retweeted_status", "quoted_status"]:
+        if key in tweet:
+            yield from process_embedded_users(tweet[key])
+
+
+def process_embedded_user(collected_at, user):
+    # these are in the same order as USER_COLUMNS
+    return [
+        collected_at, user["id_str"], user["screen_name"], user.get("name"), user.get("description"), user.get("lang"), user.get("location"), user.get("created_at"),
+        user.get("followers_count"), user.get("friends_count"), user.get("statuses_count"), user.get("favourites_count"), user.get("verified"), json.dumps(user),
+    ]
+
+
+def process_tweet(tweet):
+    user = tweet["user"]
+    retweet = tweet.get("retweeted_status", {})
+    quote = tweet.get("quoted_status", {})
+
+    hashtags = set()
+    urls = set()
+
+    if "entities" in tweet:
+        hashtags |= set(x["text"] for x in tweet["entities"]["hashtags"])
+        urls |= set(x["expanded_url"] for x in tweet["entities"]["urls"])
+
+    if "extended_tweet" in tweet:
+        hashtags |= set(x["text"] for x in tweet["extended_tweet"]["entities"]["hashtags"])
+        urls |= set(x["expanded_url"] for x in tweet["extended_tweet"]["entities"]["urls"])
+
+    if "entities" in retweet:
+        hashtags |= set(x["text"] for x in retweet["entities"]["hashtags"])
+        urls |= set(x["expanded_url"] for x in retweet["entities"]["urls"])
+
+    if "extended_tweet" in retweet:
+        hashtags |= set(x["text"] for x in retweet["extended_tweet"]["entities"]["hashtags"])
+        urls |= set(x["expanded_url"] for x in retweet["extended_tweet"]["entities"]["urls"])
+
+    if "entities" in quote:
+        hashtags |= set(x["text"] for x in quote["entities"]["hashtags"])
+        urls |= set(x["expanded_url"] for x in quote["entities"]["urls"])
+
+    if "extended_tweet" in quote:
+        hashtags |= set(x["text"] for x in quote["extended_tweet"]["entities"]["hashtags"])
+        urls |= set(x["expanded_url"] for x in quote["extended_tweet"]["entities"]["urls"])
+
+    # remove stupid urls
+    urls = set(filter(lambda x: not x.startswith("https://twitter.com/i/web/status/"), urls))
+
+    # these are in the same order as TWEET_COLUMNS
+    return [
+        tweet["id_str"], tweet["created_at"], get_complete_text(tweet), get_source(tweet["source"]), tweet["lang"], user["id_str"], user["screen_name"],
+        tweet["in_reply_to_status_id_str"], tweet["in_reply_to_user_id_str"], tweet["in_reply_to_screen_name"],
+        retweet.get("id_str"), retweet.get("user", {}).get("id_str"), retweet.get("user", {}).get("screen_name"), retweet.get("user", {}).get("user_name"), retweet.get("user", {}).get("description"),
+        retweet.get("user", {}).get("friends_count"), retweet.get("user", {}).get("statuses_count"), retweet.get("user", {}).get("followers_count"),
+        retweet.get("retweet_count"), retweet.get("favorite_count"), retweet.get("reply_count"),
+        quote.get("id_str"), quote.get("user", {}).get("id_str"), quote.get("user", {}).get("screen_name"), quote.get("user", {}).get("user_name"), quote.get("user", {}).get("description"),
+        quote.get("user", {}).get("friends_count"), quote.get("user", {}).get("statuses_count"), quote.get("user", {}).get("followers_count"),
+        quote.get("retweet_count"), quote.get("favorite_count"), quote.get("reply_count"),
+        pg_array(hashtags), pg_array(urls), json.dumps(tweet),
+    ]
+
+
+def pg_array(values):
+    # postgres array literal for a text[] column, the csv quoting goes around the outside of this
+    return "{{{}}}".format(",".join('"{}"'.format(x.replace("\\", "\\\\").replace('"', '\\"')) for x in values))
+
+
 def clean_line(data):
     line = StringIO()
     writer = csv.writer(line, quoting=csv.QUOTE_MINIMAL)
@@ -131,204 +391,235 @@ def clean_line(data):
     return NULL_TERMINATOR.sub(r"", line.getvalue())
 
 
+def clean_nullable_line(data):
+    # an empty csv field is ambiguous between null and empty text so spell out the nulls.
+    # this must be loaded with COPY_NULLABLE.
+    return clean_line(COPY_NULL if x is None else x for x in data)
+
+
+def insert_user(cur, prefix: str, user_obj: dict, collected_at: str, followers_collected: int = None, friends_collected: int = None):
+    cur.execute(f"""
+        INSERT INTO public.{prefix}_user (collected_at, id, screen_name, created_at, raw,
+            followers_collected, friends_collected,
+            name, description, location, verified,
+            favorites_count, statuses_count, followers_count, friends_count)
+        VALUES (%(collected_at)s, %(id_str)s, %(screen_name)s, %(created_at)s, %(raw)s,
+            %(followers_collected)s, %(friends_collected)s,
+            %(name)s, %(description)s, %(location)s, %(verified)s,
+            %(favorites_count)s, %(statuses_count)s, %(followers_count)s, %(friends_count)s)
+        ON CONFLICT (collected_at, id) DO UPDATE SET
+            screen_name = excluded.screen_name,
+            created_at = excluded.created_at,
+            raw = excluded.raw,
+            name = excluded.name,
+            description = excluded.description,
+            location = excluded.location,
+            verified = excluded.verified,
+            followers_collected = excluded.followers_collected,
+            friends_collected = excluded.friends_collected,
+            favorites_count = excluded.favorites_count,
+            statuses_count = excluded.statuses_count,
+            followers_count = excluded.followers_count,
+            friends_count = excluded.friends_count
+    """, {
+        **user_obj,
+        "collected_at": collected_at,
+        "raw": json.dumps(user_obj),
+        "followers_collected": followers_collected,
+        "friends_collected": friends_collected,
+    })
+
+
+def create_staging(cur, prefix: str):
+    # rows from every file in a batch gather in these until the batch is merged. they empty on commit.
+    for table in STAGED_TABLES:
+        cur.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS staging_{table} (LIKE public.{prefix}_{table}) ON COMMIT DELETE ROWS")
+
+
+def merge_staging(cur, prefix: str, tables: list = STAGED_TABLES):
+    for table in tables:
+        cur.execute(f"""
+            INSERT INTO public.{prefix}_{table}
+            SELECT * FROM staging_{table}
+            ON CONFLICT DO NOTHING
+        """)
+
+
 def load(host: str, database: str, username: str, prefix: str, input_file: str):
-    print("loading {} into {} on {} on {}".format(input_file, prefix, database, host))
+    load_batches(host, database, username, prefix, [input_file])
+
+
+def load_batches(host: str, database: str, username: str, prefix: str, input_files: list, batch_files: int = 1, batch_rows: int = None, embedded_users: bool = False, profiler: StageProfiler = NO_PROFILER):
     conn = psycopg2.connect(host=host, dbname=database, user=username)
 
     try:
-        with open(input_file, "rt") as f:
-            data = json.load(f)
-            collected_at = data["captured_at"]
-
-            if "screen_name" not in data:
-                print("could not find screen name information in {}".format(input_file))
-                return
-
-            user_obj = {}
-            if "user" in data:
-                user_obj = data["user"]
-                if "favourites_count" in user_obj:
-                    user_obj["favorites_count"] = user_obj.pop("favourites_count")
-                if "lang" in user_obj:
-                    user_obj["language"] = user_obj.pop("lang")
-            else:
-                user_obj = {
-                    "id": data["id"],
-                    "id_str": data["id"],
-                    "screen_name": data["screen_name"],
-                    "created_at": data["created_at"],
-                    "name": None,
-                    "description": None,
-                    "language": None,
-                    "location": None,
-                    "verified": None,
-                    "favorites_count": data["favorites_count"],
-                    "statuses_count": data["tweet_count"],
-                    "followers_count": None,
-                    "friends_count": None,
-                }
-
-            follower_ids = None
-            if "follower_ids" in data:
-                follower_ids = data["follower_ids"]
-
-            friend_ids = None
-            if "friend_ids" in data:
-                friend_ids = data["friend_ids"]
-
-            with conn.cursor() as cur:
-                cur.execute(f"""
-                    INSERT INTO public.{prefix}_user (collected_at, id, screen_name, created_at, raw,
-                        followers_collected, friends_collected,
-                        name, description, location, verified,
-                        favorites_count, statuses_count, followers_count, friends_count)
-                    VALUES (%(collected_at)s, %(id_str)s, %(screen_name)s, %(created_at)s, %(raw)s,
-                        %(followers_collected)s, %(friends_collected)s,
-                        %(name)s, %(description)s, %(location)s, %(verified)s,
-                        %(favorites_count)s, %(statuses_count)s, %(followers_count)s, %(friends_count)s)
-                    ON CONFLICT (collected_at, id) DO UPDATE SET
-                        screen_name = excluded.screen_name,
-                        created_at = excluded.created_at,
-                        raw = excluded.raw,
-                        name = excluded.name,
-                        description = excluded.description,
-                        location = excluded.location,
-                        verified = excluded.verified,
-                        followers_collected = excluded.followers_collected,
-                        friends_collected = excluded.friends_collected,
-                        favorites_count = excluded.favorites_count,
-                        statuses_count = excluded.statuses_count,
-                        followers_count = excluded.followers_count,
-                        friends_count = excluded.friends_count
-                """, {
-                    **user_obj,
-                    "collected_at": collected_at,
-                    "raw": json.dumps(user_obj),
-                    "followers_collected": len(follower_ids) if follower_ids is not None else None,
-                    "friends_collected": len(friend_ids) if friend_ids is not None else None,
-                })
-
-            if friend_ids:
-                generator = (
-                    clean_line(x.values())
-                    for x in process_user_friend(data["id"], collected_at, friend_ids)
-                )
-                stream = StringIteratorIO(generator)
-
-                with conn.cursor() as cur:
-                    cur.execute(f"CREATE TEMPORARY TABLE t (LIKE public.{prefix}_user_friend) ON COMMIT DROP")
-                    cur.copy_expert(f"COPY t FROM STDIN WITH CSV", stream)
-                    cur.execute(f"""
-                        INSERT INTO public.{prefix}_user_friend
-                        SELECT * FROM t
-                        ON CONFLICT DO NOTHING
-                    """)
-                    cur.execute("DROP TABLE t")
-
-            if follower_ids:
-                generator = (
-                    clean_line(x.values())
-                    for x in process_user_follower(data["id"], collected_at, follower_ids)
-                )
-                stream = StringIteratorIO(generator)
-
-                with conn.cursor() as cur:
-                    cur.execute(f"CREATE TEMPORARY TABLE t (LIKE public.{prefix}_user_follower) ON COMMIT DROP")
-                    cur.copy_expert(f"COPY t FROM STDIN WITH CSV", stream)
-                    cur.execute(f"""
-                        INSERT INTO public.{prefix}_user_follower
-                        SELECT * FROM t
-                        ON CONFLICT DO NOTHING
-                    """)
-                    cur.execute("DROP TABLE t")
-
-            for tweet in data.get("tweets", []):
-                user = tweet["user"]
-                retweet = tweet.get("retweeted_status", {})
-                quote = tweet.get("quoted_status", {})
-
-                hashtags = set()
-                urls = set()
-
-                if "entities" in tweet:
-                    hashtags |= set(x["text"] for x in tweet["entities"]["hashtags"])
-                    urls |= set(x["expanded_url"] for x in tweet["entities"]["urls"])
-
-                if "extended_tweet" in tweet:
-                    hashtags |= set(x["text"] for x in tweet["extended_tweet"]["entities"]["hashtags"])
-                    urls |= set(x["expanded_url"] for x in tweet["extended_tweet"]["entities"]["urls"])
-
-                if "entities" in retweet:
-                    hashtags |= set(x["text"] for x in retweet["entities"]["hashtags"])
-                    urls |= set(x["expanded_url"] for x in retweet["entities"]["urls"])
-
-                if "extended_tweet" in retweet:
-                    hashtags |= set(x["text"] for x in retweet["extended_tweet"]["entities"]["hashtags"])
-                    urls |= set(x["expanded_url"] for x in retweet["extended_tweet"]["entities"]["urls"])
-
-                if "entities" in quote:
-                    hashtags |= set(x["text"] for x in quote["entities"]["hashtags"])
-                    urls |= set(x["expanded_url"] for x in quote["entities"]["urls"])
-
-                if "extended_tweet" in quote:
-                    hashtags |= set(x["text"] for x in quote["extended_tweet"]["entities"]["hashtags"])
-                    urls |= set(x["expanded_url"] for x in quote["extended_tweet"]["entities"]["urls"])
-
-                # remove stupid urls
-                urls = set(filter(lambda x: not x.startswith("https://twitter.com/i/web/status/"), urls))
-
-                with conn.cursor() as cur:
-                    cur.execute(f"""
-                        INSERT INTO public.{prefix}_tweet (
-                            id, created_at, tweet, source, language, user_id, user_screen_name,
-                            in_reply_to_status_id, in_reply_to_user_id, in_reply_to_user_screen_name,
-                            retweeted_status_id, retweeted_status_user_id, retweeted_status_user_screen_name, retweeted_status_user_name, retweeted_status_user_description,
-                            retweeted_status_user_friends_count, retweeted_status_user_statuses_count, retweeted_status_user_followers_count,
-                            retweeted_status_retweet_count, retweeted_status_favorite_count, retweeted_status_reply_count,
-                            quoted_status_id, quoted_status_user_id, quoted_status_user_screen_name, quoted_status_user_name, quoted_status_user_description,
-                            quoted_status_user_friends_count, quoted_status_user_statuses_count, quoted_status_user_followers_count,
-                            quoted_status_retweet_count, quoted_status_favorite_count, quoted_status_reply_count,
-                            hashtags, urls, raw
-                        ) VALUES (
-                            -- id (7)
-                            %s, %s, %s, %s, %s, %s, %s,
-                            -- in_reply_to_status_id (3)
-                            %s, %s, %s,
-                            -- retweeted_status_id (5)
-                            %s, %s, %s, %s, %s,
-                            -- retweeted_status_user_friends_count (3)
-                            %s, %s, %s,
-                            -- retweeted_status_retweet_count (3)
-                            %s, %s, %s,
-                            -- quoted_status_id (5)
-                            %s, %s, %s, %s, %s,
-                            -- quoted_status_user_friends_count
-                            %s, %s, %s,
-                            -- quoted_status_retweet_count
-                            %s, %s, %s,
-                            -- hashtags, urls, raw
-                            %s, %s, %s
-                        ) ON CONFLICT (id) DO NOTHING
-                    """, [
-                        tweet["id_str"], tweet["created_at"], get_complete_text(tweet), get_source(tweet["source"]), tweet["lang"], user["id_str"], user["screen_name"],
-                        tweet["in_reply_to_status_id_str"], tweet["in_reply_to_user_id_str"], tweet["in_reply_to_screen_name"],
-                        retweet.get("id_str"), retweet.get("user", {}).get("id_str"), retweet.get("user", {}).get("screen_name"), retweet.get("user", {}).get("user_name"), retweet.get("user", {}).get("description"),
-                        retweet.get("user", {}).get("friends_count"), retweet.get("user", {}).get("statuses_count"), retweet.get("user", {}).get("followers_count"),
-                        retweet.get("retweet_count"), retweet.get("favorite_count"), retweet.get("reply_count"),
-                        quote.get("id_str"), quote.get("user", {}).get("id_str"), quote.get("user", {}).get("screen_name"), quote.get("user", {}).get("user_name"), quote.get("user", {}).get("description"),
-                        quote.get("user", {}).get("friends_count"), quote.get("user", {}).get("statuses_count"), quote.get("user", {}).get("followers_count"),
-                        quote.get("retweet_count"), quote.get("favorite_count"), quote.get("reply_count"),
-                        list(hashtags), list(urls), json.dumps(tweet),
-                    ])
-
+        with conn.cursor() as cur:
+            create_staging(cur, prefix)
         conn.commit()
+
+        batch = []
+        rows = 0
+        for input_file in input_files:
+            print("loading {} into {} on {} on {}".format(input_file, prefix, database, host))
+            rows += load_file(conn, prefix, input_file, embedded_users, profiler)
+            batch.append(input_file)
+
+            if len(batch) >= batch_files or (batch_rows is not None and rows >= batch_rows):
+                commit_batch(conn, prefix, batch, embedded_users, profiler)
+                batch = []
+                rows = 0
+
+        if batch:
+            commit_batch(conn, prefix, batch, embedded_users, profiler)
+    finally:
+        conn.close()
+
+
+def commit_batch(conn, prefix: str, batch: list, embedded_users: bool = False, profiler: StageProfiler = NO_PROFILER):
+    try:
+        with conn.cursor() as cur, profiler.stage("merge"):
+            merge_staging(cur, prefix)
+        with profiler.stage("commit"):
+            conn.commit()
+        if len(batch) > 1:
+            print("committed {} files into {}".format(len(batch), prefix))
     except Exception:
         traceback.print_exc()
         try:
-            self.cnx.rollback()
+            conn.rollback()
         except Exception:
             pass
 
+        # something in the batch broke the merge so go back and find out which file it was
+        if len(batch) > 1:
+            print("retrying {} files one at a time".format(len(batch)))
+            for input_file in batch:
+                load_file(conn, prefix, input_file, embedded_users, profiler)
+                commit_batch(conn, prefix, [input_file], embedded_users, profiler)
+
+
+def load_file(conn, prefix: str, input_file: str, embedded_users: bool = False, profiler: StageProfiler = NO_PROFILER):
+    # a savepoint lets one bad file be thrown away without losing the rest of its batch
+    with conn.cursor() as cur:
+        cur.execute("SAVEPOINT load_file")
+
+    profiler.begin_file(input_file)
+    try:
+        rows = stage_file(conn, prefix, input_file, embedded_users, profiler)
+        with conn.cursor() as cur:
+            cur.execute("RELEASE SAVEPOINT load_file")
+        return rows
+    except Exception:
+        print("could not load {}".format(input_file))
+        traceback.print_exc()
+        with conn.cursor() as cur:
+            cur.execute("ROLLBACK TO SAVEPOINT load_file")
+        return 0
+    finally:
+        profiler.end_file()
+
+
+def stage_file(conn, prefix: str, input_file: str, embedded_users: bool = False, profiler: StageProfiler = NO_PROFILER):
+    rows = 0
+
+    with compression.open_input(input_file) as f:
+        with profiler.stage("json_load"):
+            data = json.load(f)
+        # the decompressed size, which is what json_load had to get through
+        profiler.count("input_bytes", f.buffer.tell())
+        collected_at = data["captured_at"]
+
+        if "screen_name" not in data:
+            print("could not find screen name information in {}".format(input_file))
+            return rows
+
+        if data.get("sink") == "postgres":
+            print("{} was written straight to the database when it was fetched".format(input_file))
+            return rows
+
+        user_obj = process_user(data)
+
+        follower_ids = None
+        if "follower_ids" in data:
+            follower_ids = data["follower_ids"]
+
+        friend_ids = None
+        if "friend_ids" in data:
+            friend_ids = data["friend_ids"]
+
+        # the user goes straight into its table because the friends and followers refer to it
+        with conn.cursor() as cur, profiler.stage("user_insert"):
+            insert_user(cur, prefix, user_obj, collected_at,
+                        followers_collected=len(follower_ids) if follower_ids is not None else None,
+                        friends_collected=len(friend_ids) if friend_ids is not None else None)
+            rows += 1
+            profiler.count("user", 1)
+
+        clean = profiler.wrap("clean_line", clean_line)
+        clean_nullable = profiler.wrap("clean_line", clean_nullable_line)
+        extract = profiler.wrap("extract", process_tweet)
+
+        if friend_ids:
+            generator = (
+                clean(x.values())
+                for x in process_user_friend(data["id"], collected_at, friend_ids)
+            )
+            stream = profiler.stream(StringIteratorIO(generator))
+
+            with conn.cursor() as cur, profiler.stage("copy"):
+                cur.copy_expert(f"COPY staging_user_friend FROM STDIN WITH CSV", stream)
+            rows += len(friend_ids)
+            profiler.count("user_friend", len(friend_ids))
+
+        if follower_ids:
+            generator = (
+                clean(x.values())
+                for x in process_user_follower(data["id"], collected_at, follower_ids)
+            )
+            stream = profiler.stream(StringIteratorIO(generator))
+
+            with conn.cursor() as cur, profiler.stage("copy"):
+                cur.copy_expert(f"COPY staging_user_follower FROM STDIN WITH CSV", stream)
+            rows += len(follower_ids)
+            profiler.count("user_follower", len(follower_ids))
+
+        tweets = data.get("tweets") or []
+        if tweets:
+            generator = (
+                clean_nullable(extract(tweet))
+                for tweet in tweets
+            )
+            stream = profiler.stream(StringIteratorIO(generator))
+
+            with conn.cursor() as cur, profiler.stage("copy"):
+                cur.copy_expert(f"COPY staging_tweet ({', '.join(TWEET_COLUMNS)}) FROM STDIN WITH {COPY_NULLABLE}", stream)
+            rows += len(tweets)
+            profiler.count("tweet", len(tweets))
+
+        if tweets and embedded_users:
+            # every row from this file shares one collected_at, so a user only needs to be written once per file.
+            # the account itself was loaded above and trimmed users have nothing worth keeping.
+            with profiler.stage("extract"):
+                seen = {data["id"]}
+                embedded = []
+                for tweet in tweets:
+                    for user in process_embedded_users(tweet):
+                        if "screen_name" in user and user["id_str"] not in seen:
+                            seen.add(user["id_str"])
+                            embedded.append(process_embedded_user(collected_at, user))
+            generator = (
+                clean_nullable(x)
+                for x in embedded
+            )
+            stream = profiler.stream(StringIteratorIO(generator))
+
+            with conn.cursor() as cur, profiler.stage("copy"):
+                cur.copy_expert(f"COPY staging_user ({', '.join(USER_COLUMNS)}) FROM STDIN WITH {COPY_NULLABLE}", stream)
+            rows += len(embedded)
+            profiler.count("embedded_user", len(embedded))
+
+    return rows
+
 
 if __name__ == "__main__":
     username = getpass.getuser()
@@ -343,6 +634,12 @@ if __name__ == "__main__":
     parser.add_argument("-d", "--database", help="the database to load the data into", default=username)
     parser.add_argument("-u", "--username", help="the name of the user to use when connecting to the database", default=username)
     parser.add_argument("-p", "--prefix", help="the prefix of the database tables to load this into", required=True)
+    parser.add_argument("--batch-files", dest="batch_files", type=int, help="commit after loading this many files", default=1)
+    parser.add_argument("--batch-rows", dest="batch_rows", type=int, help="commit early once a batch has this many rows")
+    parser.add_argument("--embedded-users", dest="embedded_users", action="store_true", help="also load the users embedded in each tweet into the user table")
+    parser.add_argument("--profile", action="store_true", help="time each stage of the load and print a summary to stderr")
+    parser.add_argument("--profile-report", dest="profile_report", help="also write the timings for each stage and each file to this json file")
+    parser.add_argument("--cprofile", help="write a cProfile dump of the whole load to this file")
     args = parser.parse_args()
 
     try:
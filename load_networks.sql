@@ -18,6 +18,8 @@ CREATE TABLE public.network_user (
     primary key (id, collected_at)
 );
 
+CREATE INDEX network_user_screen_name_idx ON public.network_user (screen_name);
+
 
 CREATE TABLE public.network_user_friend (
     collected_at timestamp with time zone not null,
@@ -0,0 +1,232 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import requests
+import sys
+import traceback
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+from threading import Lock, local
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+# only requests to twitter are archived. anything else goes out as normal.
+HOSTS = ("api.twitter.com",)
+
+# rate limits and server errors say nothing about the data and would only come back again on replay
+SKIPPED_STATUSES = (420, 429)
+
+INDEX_FILE = "index.jsonl"
+OBJECTS_DIRECTORY = "objects"
+
+# every request made by requests, and so by tweepy, goes through this
+_send = HTTPAdapter.send
+_archive = None
+_replay = False
+_local = local()
+
+
+def add_arguments(parser):
+    parser.add_argument("--archive", help="a directory to save every raw api response into as it is fetched so the run can be replayed later")
+    parser.add_argument("--replay", help="a directory made with --archive to answer every api request from instead of twitter")
+
+
+def normalize_query(query):
+    return urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+
+def request_key(request):
+    # oauth goes in a header that changes every time, so the method, url and form body are what identify a request.
+    # parameters are sorted so that the order tweepy happens to send them in doesn't matter.
+    parts = urlsplit(request.url)
+    key = "{} {}".format(request.method, urlunsplit((parts.scheme, parts.netloc, parts.path, normalize_query(parts.query), "")))
+
+    body = request.body
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    if body:
+        key = "{} {}".format(key, normalize_query(body))
+    return key
+
+
+class Archive:
+    # bodies are stored once each under their sha256 and the index says which request got which body. the index is
+    # only ever appended to and the last entry for a request wins, so archiving into the same directory again
+    # replays the newer responses.
+    def __init__(self, directory: str, writable: bool = False):
+        self.directory = directory
+        self.entries = {}
+        self.lock = Lock()
+        self.index = None
+
+        index_file = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_file):
+            with open(index_file, "rt") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry
+
+        if writable:
+            os.makedirs(os.path.join(directory, OBJECTS_DIRECTORY), exist_ok=True)
+            self.index = open(index_file, "at")
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, OBJECTS_DIRECTORY, digest[:2], "{}.gz".format(digest))
+
+    def store(self, key: str, response, fetched_at: datetime):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # another thread could be writing the same body so each one writes its own temporary file
+            tmp_file = "{}.{}.tmp".format(path, id(response))
+            with gzip.open(tmp_file, "wb") as f:
+                f.write(content)
+            os.replace(tmp_file, path)
+
+        entry = {
+            "key": key,
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type"),
+            "sha256": digest,
+            "size": len(content),
+            "fetched_at": str(fetched_at),
+        }
+        with self.lock:
+            self.index.write(json.dumps(entry))
+            self.index.write("\n")
+            self.index.flush()
+            self.entries[key] = entry
+
+    def load(self, entry) -> bytes:
+        with gzip.open(self.object_path(entry["sha256"]), "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+
+
+def build_response(request, entry, content):
+    # only the content type comes back. without the rate limit headers tweepy never waits while replaying.
+    response = requests.Response()
+    response.status_code = entry["status"]
+    if entry["content_type"] is not None:
+        response.headers["content-type"] = entry["content_type"]
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = content
+    response.url = request.url
+    response.request = request
+    response.reason = "Replayed"
+    return response
+
+
+def send(adapter, request, **kwargs):
+    if _archive is None or urlsplit(request.url).hostname not in HOSTS:
+        return _send(adapter, request, **kwargs)
+
+    key = request_key(request)
+    if _replay:
+        entry = _archive.entries.get(key)
+        if entry is None:
+            # tweepy turns this into a TweepError so it is handled like any other request that failed
+            raise requests.exceptions.ConnectionError("{} is not in the archive".format(key), request=request)
+        _local.fetched_at = entry["fetched_at"]
+        return build_response(request, entry, _archive.load(entry))
+
+    fetched_at = datetime.now()
+    response = _send(adapter, request, **kwargs)
+    if response.status_code not in SKIPPED_STATUSES and response.status_code < 500:
+        _archive.store(key, response, fetched_at)
+    return response
+
+
+def install(args):
+    # call this once before any requests are made. does nothing unless --archive or --replay was given.
+    global _archive, _replay
+
+    if args.archive is not None and args.replay is not None:
+        raise ValueError("--archive and --replay can't be used together")
+    if args.archive is None and args.replay is None:
+        return None
+
+    logger = logging.getLogger()
+    if args.replay is not None:
+        if not os.path.exists(os.path.join(args.replay, INDEX_FILE)):
+            raise ValueError("{} is not an archive".format(args.replay))
+        _archive = Archive(args.replay)
+        _replay = True
+        logger.info("replaying {} responses from {}".format(len(_archive.entries), args.replay))
+    else:
+        _archive = Archive(args.archive, writable=True)
+        _replay = False
+        logger.info("archiving responses to {}".format(args.archive))
+
+    HTTPAdapter.send = send
+    return _archive
+
+
+def now() -> datetime:
+    # while replaying this is when the last response on this thread was originally fetched, so that captured_at
+    # comes out the same as it did the first time
+    if _replay and getattr(_local, "fetched_at", None) is not None:
+        return datetime.fromisoformat(_local.fetched_at)
+    return datetime.now()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="response_archive",
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument("directory", help="a directory made with --archive")
+    parser.add_argument("--verify", action="store_true", help="check that every stored body is readable and matches its hash")
+    args = parser.parse_args()
+
+    # configure logging
+    logging.captureWarnings(True)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    log_handler = logging.StreamHandler(stream=sys.stderr)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s - %(message)s"))
+    logger.addHandler(log_handler)
+
+    try:
+        archive = Archive(args.directory)
+
+        endpoints = {}
+        for key in archive.entries:
+            endpoint = urlsplit(key.split(" ")[1]).path
+            endpoints[endpoint] = endpoints.get(endpoint, 0) + 1
+        for endpoint, count in sorted(endpoints.items()):
+            print("{},{}".format(endpoint, count))
+
+        bad = 0
+        if args.verify:
+            for entry in archive.entries.values():
+                try:
+                    if hashlib.sha256(archive.load(entry)).hexdigest() != entry["sha256"]:
+                        raise ValueError("hash does not match")
+                except Exception as e:
+                    logger.error("{}: {}".format(entry["key"], e))
+                    bad += 1
+            logger.info("checked {} responses, {} bad".format(len(archive.entries), bad))
+
+        return 1 if bad else 0
+    except Exception:
+        logger.error(traceback.format_exc())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import argparse
+import compression
+import fetch_profiles
+import json
+import logging
+import os
+import response_archive
+import sys
+import traceback
+import tweepy
+from datetime import datetime, timedelta, timezone
+from queue import Queue
+from threading import Lock, Thread
+
+
+# tweet ids start with the number of milliseconds since this moment
+TWITTER_EPOCH = 1288834974657
+
+
+def id_for_time(value: datetime) -> int:
+    return (int(value.timestamp() * 1000) - TWITTER_EPOCH) << 22
+
+
+def time_for_id(tweet_id: int) -> datetime:
+    return datetime.fromtimestamp(((tweet_id >> 22) + TWITTER_EPOCH) / 1000, tz=timezone.utc)
+
+
+def parse_time(value: str) -> datetime:
+    # times on the command line are always utc
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def split_range(since_id: int, max_id: int, shards: int):
+    # disjoint ranges that cover everything after since_id up to and including max_id. ids are
+    # timestamps so equal id ranges are equal slices of time.
+    step = max((max_id - since_id) // shards, 1)
+    bounds = list(range(since_id, max_id, step))[:shards] + [max_id]
+    for i in range(len(bounds) - 1):
+        yield (bounds[i], bounds[i + 1])
+
+
+def get_API(credentials):
+    auth = tweepy.OAuthHandler(credentials["consumer_key"], credentials["consumer_secret"])
+    auth.set_access_token(credentials["access_token"], credentials["access_token_secret"])
+    return tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
+
+
+def shard_file(output, since_id, max_id, writer):
+    return os.path.join(output, "{}-{}.json{}".format(since_id, max_id, writer.extension()))
+
+
+def search_shard(api, query, since_id, max_id, output, profile, writer, options):
+    logger = logging.getLogger()
+
+    write_file = shard_file(output, since_id, max_id, writer)
+    if os.path.exists(write_file):
+        logger.info("data already fetched {}".format(write_file))
+        with compression.open_input(write_file) as f:
+            return sum(1 for _ in f)
+
+    # write somewhere else first so that a shard that was cut off part way gets searched again
+    count = 0
+    tmp_file = "{}.tmp".format(write_file)
+    with writer.open(tmp_file) as f:
+        cursor = tweepy.Cursor(api.search, q=query, since_id=since_id, max_id=max_id, count=100, tweet_mode="extended", **options, **profile.lookup_params())
+        for tweet in cursor.items():
+            f.write(json.dumps(profile.apply(tweet._json), default=str, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    os.rename(tmp_file, write_file)
+
+    logger.info("found {} tweets between {} and {}".format(count, time_for_id(since_id), time_for_id(max_id)))
+    return count
+
+
+def search_shards(queue, credentials, query, output, profile, writer, options, results, lock):
+    logger = logging.getLogger()
+    api = get_API(credentials)
+
+    while not queue.empty():
+        shard = queue.get(block=False)
+        if shard is None:
+            continue
+
+        since_id, max_id = shard
+        try:
+            logger.info("searching {} to {} with {}".format(since_id, max_id, credentials["consumer_key"]))
+            count = search_shard(api, query, since_id, max_id, output, profile, writer, options)
+            with lock:
+                results[shard] = count
+        except Exception as e:
+            logger.error("could not search {} to {}: {}".format(since_id, max_id, e))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="search_tweets",
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument("credentials", help="a json file containing credentials to use")
+    parser.add_argument("query", help="the search query, as it would be typed into twitter")
+    parser.add_argument("output", help="a directory to place the output files, one per slice of the search")
+    parser.add_argument("--since", help="the earliest time to search from in utc, such as \"2023-01-01 00:00:00\". defaults to seven days ago.")
+    parser.add_argument("--until", help="the latest time to search up to in utc. defaults to now.")
+    parser.add_argument("--since-id", dest="since_id", type=int, help="search for tweets after this id instead of after --since")
+    parser.add_argument("--max-id", dest="max_id", type=int, help="search for tweets up to and including this id instead of up to --until")
+    parser.add_argument("--shards", type=int, help="how many slices to split the search into. defaults to four per credential.")
+    parser.add_argument("--lang", help="only find tweets in this language")
+    parser.add_argument("--result-type", dest="result_type", choices=["recent", "mixed", "popular"], default="recent", help="which tweets twitter should return")
+    fetch_profiles.add_arguments(parser)
+    compression.add_arguments(parser)
+    response_archive.add_arguments(parser)
+    args = parser.parse_args()
+
+    # configure logging
+    logging.captureWarnings(True)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    log_handler = logging.StreamHandler(stream=sys.stderr)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s - %(message)s"))
+    logger.addHandler(log_handler)
+
+    # start the main program
+    try:
+        response_archive.install(args)
+
+        credentials = []
+        with open(args.credentials, "rt") as f:
+            credentials = json.load(f)
+        logger.info("found {} credentials to use".format(len(credentials)))
+
+        now = datetime.now(timezone.utc)
+        since_id = args.since_id
+        if since_id is None:
+            since_id = id_for_time(parse_time(args.since) if args.since else now - timedelta(days=7))
+        max_id = args.max_id
+        if max_id is None:
+            max_id = id_for_time(parse_time(args.until) if args.until else now)
+        if max_id <= since_id:
+            parser.error("the search has to end after it starts")
+
+        # more slices than credentials so that a busy slice doesn't leave the other credentials idle at the end
+        shards = list(split_range(since_id, max_id, args.shards or 4 * len(credentials)))
+        logger.info("searching {} to {} in {} slices".format(time_for_id(since_id), time_for_id(max_id), len(shards)))
+
+        queue = Queue()
+        for shard in shards:
+            queue.put(shard)
+
+        options = {"result_type": args.result_type}
+        if args.lang:
+            options["lang"] = args.lang
+
+        os.makedirs(args.output, exist_ok=True)
+        profile = fetch_profiles.FetchProfile(args.fetch_profile)
+        writer = compression.Writer(args.compression, args.compression_level, args.output)
+
+        results = {}
+        lock = Lock()
+        threads = []
+        for credential in credentials:
+            t = Thread(args=(queue, credential, args.query, args.output, profile, writer, options, results, lock), target=search_shards)
+            threads.append(t)
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        # the manifest says which files make up the search and which slices still need to be run again
+        with open(os.path.join(args.output, "manifest.json"), "wt") as f:
+            print(json.dumps({
+                "query": args.query,
+                "captured_at": str(datetime.now()),
+                "since_id": str(since_id),
+                "max_id": str(max_id),
+                "since": str(time_for_id(since_id)),
+                "until": str(time_for_id(max_id)),
+                "shards": [{
+                    "since_id": str(lo),
+                    "max_id": str(hi),
+                    "file": os.path.basename(shard_file(args.output, lo, hi, writer)),
+                    "tweets": results.get((lo, hi)),
+                    "complete": (lo, hi) in results,
+                } for lo, hi in shards],
+            }, indent=4), file=f)
+
+        missing = len(shards) - len(results)
+        if missing:
+            logger.error("{} slices could not be searched. to retry them run this again with --since-id {} --max-id {} --shards {}".format(missing, since_id, max_id, len(shards)))
+            return 1
+
+        logger.info("found {} tweets".format(sum(results.values())))
+        return 0
+    except Exception:
+        logger.error(traceback.format_exc())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())